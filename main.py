@@ -1,20 +1,37 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Query, Depends, Request
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
+from typing import List, Union
+from pydantic import BaseModel, Field
 from src.recommend import Recommend
-import requests
+from src.mal import MALClient, MALError, completed
+from src.cache import UserListCache
+from src.coalesce import SingleFlight
+from src.genres import genre_token
+from src.records import RecordsResponse, paginate, MAX_PAGE_SIZE
+from src.executor import RecommendExecutor, ExecutorSaturated
+from src.metrics import Histogram, timed, render
+import time
 import os
 from dotenv import load_dotenv, dotenv_values
 
 
 load_dotenv() 
 
+BATCH_MAX_SEEDS = int(os.getenv('BATCH_MAX_SEEDS', 50))
+
+request_seconds = Histogram('request_seconds', 'Time to answer a request, by route and status.', ('route', 'status'))
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    rec = Recommend()
-    app.state.rec = rec 
+    app.state.executor = RecommendExecutor(Recommend) # Recommend / Search work runs here, never on the event loop
+    app.state.mal = MALClient()
+    app.state.user_lists = UserListCache(app.state.mal)
+    app.state.flights = SingleFlight() # identical concurrent requests share one computation
     yield  
-    del app.state.rec
+    await app.state.mal.aclose()
+    app.state.executor.shutdown()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -25,52 +42,131 @@ origins = [
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
-    allow_methods=['GET'],
+    allow_methods=['GET', 'POST'],
     allow_headers=["*"],
 )
 
+@app.middleware('http')
+async def time_request(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get('route') # path template, so /categories/anime/{anime_name} is one series
+    request_seconds.observe(time.perf_counter() - start, route.path if route else 'unmatched', str(response.status_code))
+    return response
+
+async def offload(stage: str, method: str, *args):
+    try:
+        return await app.state.executor.run(stage, method, *args)
+    except ExecutorSaturated as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={'Retry-After': '1'})
+
+def page_query(limit: int = Query(MAX_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), cursor: str = None, fields: str = None):
+    '''
+    ?limit=20&cursor=<next of the previous page>&fields=id,name,image
+    '''
+    fields = [field.strip() for field in fields.split(',') if field.strip()] if fields else None
+    return {'limit': limit, 'cursor': cursor, 'fields': fields}
+
+def page_response(result, page: dict, **extra):
+    '''
+    One page of a cached ranking, later pages are sliced from the same cached result instead of recomputed.
+    '''
+    with timed('serialization'):
+        try:
+            body = paginate(result, **page)
+        except KeyError as e:
+            raise HTTPException(status_code=400, detail=f'unknown fields: {e.args[0]}')
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return RecordsResponse({**body, **extra}) # encoding errors are ours, they stay 500s
+
+def title_key(name: str):
+    '''
+    Cache key of a title: the anime_id it resolves to (the same lookup as Search.get_anime_id, a dict hit),
+    so titles that only normalise alike, i.e. 'Working!!' and "Working'!!", never share a result.
+    The raw title when nothing matches, or when the catalog only lives in the process pool.
+    '''
+    search = getattr(app.state.executor.instance, 'search', None)
+    if(search is None):
+        return name
+    id = search.get_anime_id(name)
+    return name if id == -1 else id
+
 @app.get('/')
 async def root():
     return {"message": "Hello World"}
 
-@app.get("/categories/anime/{anime_name}")
-async def get_rec_anime(anime_name: str):
-    return {'data': app.state.rec.get_rec_anime(anime_name)}
+@app.get("/categories/anime/{anime_name}", response_class=RecordsResponse)
+async def get_rec_anime(anime_name: str, page: dict = Depends(page_query)):
+    async def compute():
+        return await offload('anime', 'get_rec_anime', anime_name)
 
-@app.get("/categories/genre/{genres}")
-async def get_rec_genre(genres: str):
+    key = ('anime', title_key(anime_name))
+    return page_response(await app.state.flights.do(key, compute), page)
+
+@app.get("/categories/genre/{genres}", response_class=RecordsResponse)
+async def get_rec_genre(genres: str, page: dict = Depends(page_query)):
     genre_list = genres.split()
-    return {'data': app.state.rec.get_rec_genre(genre_list)}
-
-@app.get("/categories/user/{user}")
-async def get_rec_user(user: str):
-    url = "https://api.myanimelist.net/v2/users/{name}/animelist?&fields=id,title,genres,list_status&status=completed&limit=1000&field=list_status&sort=list_score".format(name = user)
-    header = {"X-MAL-CLIENT-ID": os.getenv("X_MAL_CLIENT_ID")}
-
-    r = requests.get(url, headers=header)
-    r = r.json()
-    completed_animes = r['data']
-    while 'paging' in r and 'next' in r['paging']:
-        r = requests.get(url=r['paging']['next'], headers=header).json()
-        completed_animes.extend(r['data'])
-    
-    allAnimes = await get_all_animes_user(user)
-    return {'data': app.state.rec.get_rec_user(completed_animes, allAnimes)}
-  
-async def get_all_animes_user(user: str):
-    url = "https://api.myanimelist.net/v2/users/{name}/animelist?&fields=id,title,genres,list_status&limit=1000&field=list_status&sort=list_score".format(name = user)
-    header = {"X-MAL-CLIENT-ID": os.getenv("X_MAL_CLIENT_ID")}
-
-    r = requests.get(url, headers=header)
-    r = r.json()
-    animes = r['data']
-    while 'paging' in r and 'next' in r['paging']:
-        r = requests.get(url=r['paging']['next'], headers=header).json()
-        animes.extend(r['data'])
-    
-    return animes
+    async def compute():
+        return await offload('genre', 'get_rec_genre', genre_list)
+
+    key = ('genre', tuple(sorted({genre_token(genre) for genre in genre_list})))
+    return page_response(await app.state.flights.do(key, compute), page)
+
+@app.get("/categories/user/{user}", response_class=RecordsResponse)
+async def get_rec_user(user: str, page: dict = Depends(page_query)):
+    async def compute():
+        try:
+            with timed('mal_fetch'):
+                allAnimes = await app.state.user_lists.get_animelist(user) # fetched once, completed animes are a subset of it
+        except MALError as e:
+            raise HTTPException(status_code=404 if e.status_code == 404 else 502, detail=str(e))
+
+        return await offload('user', 'get_rec_user', completed(allAnimes), allAnimes)
+
+    key = ('user', user.casefold())
+    return page_response(await app.state.flights.do(key, compute), page)
+
+class Seed(BaseModel):
+    anime: Union[int, str] # anime_id or title
+    weight: float = Field(1.0, gt=0)
+
+class BatchRequest(BaseModel):
+    seeds: List[Seed] = Field(..., min_length=1, max_length=BATCH_MAX_SEEDS)
+
+@app.post("/categories/batch", response_class=RecordsResponse)
+async def get_rec_batch(batch: BatchRequest, page: dict = Depends(page_query)):
+    '''
+    One merged ranking for several animes, i.e. {"seeds": [{"anime": "Naruto", "weight": 2}, {"anime": 5114}]}.
+    Seeds that match no anime are listed in 'unresolved'.
+    '''
+    seeds = [(seed.anime, seed.weight) for seed in batch.seeds]
+    async def compute():
+        return await offload('batch', 'get_rec_batch', seeds)
+
+    key = ('batch', tuple((('title', title_key(anime)) if isinstance(anime, str) else ('id', anime), weight) for anime, weight in seeds))
+    result = await app.state.flights.do(key, compute)
+    return page_response(result['records'], page, unresolved=result['unresolved'])
 
 @app.get("/genres")
 async def get_stats_anime():
-    return {'data': app.state.rec.getAllGenres()}
+    return {'data': await offload('genres', 'getAllGenres')}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    '''
+    Prometheus text format: request / stage / executor latency histograms and the cache counters, of this worker process.
+    '''
+    content = render(service_stats())
+    return PlainTextResponse(content, media_type='text/plain; version=0.0.4')
+
+@app.get("/stats")
+async def get_stats():
+    return service_stats()
 
+def service_stats():
+    return {
+        'executor': app.state.executor.stats(),
+        'results': app.state.flights.stats(),
+        'user_lists': app.state.user_lists.stats(),
+    }
@@ -0,0 +1,48 @@
+import os
+from contextlib import contextmanager
+import numpy as np
+
+try:
+    import fcntl
+except ImportError: # Windows, only used for local single-process runs
+    fcntl = None
+
+LOCK_FILE = '.build.lock'
+
+
+@contextmanager
+def build_lock(directory: str, shared: bool = False):
+    '''
+    Cross-process lock on a model directory. With several uvicorn workers booting at once,
+    one worker builds the artifacts (exclusive) while the others wait and then open what it wrote (shared).
+    '''
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, LOCK_FILE), 'a') as f:
+        if(fcntl is not None):
+            fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if(fcntl is not None):
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+@contextmanager
+def replace_file(path: str):
+    '''
+    Yields a temporary path that replaces `path` once written. Workers that still have the old file
+    mmapped keep reading the old inode instead of a truncated file.
+    '''
+    tmp = f'{path}.{os.getpid()}.tmp'
+    try:
+        yield tmp
+        os.replace(tmp, path)
+    finally:
+        if(os.path.exists(tmp)):
+            os.remove(tmp)
+
+
+def save_array(path: str, array: np.ndarray):
+    with replace_file(path) as tmp:
+        with open(tmp, 'wb') as f:
+            np.save(f, array)
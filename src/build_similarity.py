@@ -0,0 +1,149 @@
+"""
+  Offline build of the item-item similarity model the service loads.
+
+  --
+
+  1. reads a user x anime ratings table in chunks (SQL query or csv) into a sparse matrix.
+  2. centres every user's ratings on their mean (adjusted cosine), normalises every anime's column.
+  3. computes the similarities of a block of animes against all animes at a time across a process pool,
+     keeping only the top k neighbors of each anime, so memory is bounded by block x N instead of N x N.
+  4. writes the neighbor table (src.similarity.NeighborIndex) to the model directory, replacing any dense
+     store converted from Data.csv so the service does not rebuild the table from it.
+
+  python -m src.build_similarity --csv ratings.csv --k 300 --workers 8
+  python -m src.build_similarity --sql "select user_id, anime_id, rating from ratings"
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from src.artifacts import build_lock
+from src.similarity import MODEL_DIR, NEIGHBORS_K, NeighborIndex, remove_store
+
+CHUNK_SIZE = 1_000_000
+
+
+def read_ratings(chunks, user_column: str, item_column: str, rating_column: str, min_rating: float):
+    '''
+    Sparse (users, animes) float32 ratings matrix and the anime_id of every column.
+    Ratings below min_rating (i.e. MAL's 0 / -1 for watched but unrated) are skipped.
+    '''
+    users = {}
+    items = {}
+    rows, columns, ratings = [], [], []
+    for chunk in chunks:
+        chunk = chunk[chunk[rating_column] >= min_rating]
+        rows.append(np.fromiter((users.setdefault(user, len(users)) for user in chunk[user_column]), dtype=np.int32, count=len(chunk)))
+        columns.append(np.fromiter((items.setdefault(int(item), len(items)) for item in chunk[item_column]), dtype=np.int32, count=len(chunk)))
+        ratings.append(chunk[rating_column].to_numpy(dtype=np.float32))
+        print(f'read {sum(len(r) for r in rows)} ratings of {len(users)} users on {len(items)} animes')
+
+    matrix = sparse.csr_matrix(
+        (np.concatenate(ratings), (np.concatenate(rows), np.concatenate(columns))),
+        shape=(len(users), len(items)), dtype=np.float32,
+    ) # duplicate (user, anime) ratings are summed, dedupe upstream
+    ids = np.fromiter(items.keys(), dtype=np.int32, count=len(items))
+    return matrix, ids
+
+
+def normalized_items(ratings: sparse.csr_matrix):
+    '''
+    (animes, users) matrix of mean-centred ratings, each anime's row scaled to unit length.
+    '''
+    counts = np.diff(ratings.indptr)
+    means = np.divide(np.asarray(ratings.sum(axis=1)).ravel(), counts, out=np.zeros(ratings.shape[0], dtype=np.float32), where=counts > 0)
+
+    centred = ratings.copy()
+    centred.data -= np.repeat(means, counts).astype(np.float32)
+
+    items = sparse.csr_matrix(centred.T)
+    norms = np.sqrt(np.asarray(items.multiply(items).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    items = sparse.diags(1 / norms.astype(np.float32)) @ items
+    return sparse.csr_matrix(items, dtype=np.float32)
+
+
+items_matrix: sparse.csr_matrix = None
+
+def init_worker(matrix: sparse.csr_matrix):
+    global items_matrix
+    items_matrix = matrix
+
+def top_k_block(start: int, stop: int, k: int, min_similarity: float):
+    '''
+    Top k neighbors of the animes in [start, stop), padded with -1 where fewer than k are above min_similarity.
+    '''
+    block = (items_matrix[start:stop] @ items_matrix.T).toarray()
+    block[np.arange(stop - start), np.arange(start, stop)] = -np.inf # never its own neighbor
+
+    top = np.argpartition(block, -k, axis=1)[:, -k:]
+    top_sims = np.take_along_axis(block, top, axis=1)
+    order = np.argsort(-top_sims, axis=1, kind='stable')
+    top = np.take_along_axis(top, order, axis=1).astype(np.int32)
+    top_sims = np.take_along_axis(top_sims, order, axis=1)
+
+    top[top_sims <= min_similarity] = -1
+    top_sims[top_sims <= min_similarity] = 0
+    return start, top, top_sims
+
+
+def build(ratings: sparse.csr_matrix, ids: np.ndarray, k: int = NEIGHBORS_K, block: int = 512, workers: int = None,
+          min_similarity: float = 0, dtype: str = 'float16'):
+    items = normalized_items(ratings)
+    n = items.shape[0]
+    k = min(k, n - 1)
+
+    positions = np.empty((n, k), dtype=np.int32)
+    similarities = np.empty((n, k), dtype=dtype)
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(items,)) as pool:
+        futures = [pool.submit(top_k_block, start, min(start + block, n), k, min_similarity) for start in range(0, n, block)]
+        for done, future in enumerate(futures, 1):
+            start, top, top_sims = future.result()
+            positions[start:start + len(top)] = top
+            similarities[start:start + len(top)] = top_sims
+            print(f'block {done}/{len(futures)}')
+
+    return NeighborIndex(ids, positions, similarities)
+
+
+def save(neighbors: NeighborIndex, directory: str = MODEL_DIR):
+    '''
+    Writes the table in place of whatever model the directory held.
+    '''
+    with build_lock(directory): # workers booting meanwhile wait instead of reading a half written table
+        neighbors.save(directory)
+        remove_store(directory)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the top-k item similarity model from a ratings table.')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--csv', help='ratings file with user, anime and rating columns')
+    source.add_argument('--sql', help='query returning user, anime and rating columns (SQL_ALCHEMY_CRED database)')
+    parser.add_argument('--user-column', default='user_id')
+    parser.add_argument('--item-column', default='anime_id')
+    parser.add_argument('--rating-column', default='rating')
+    parser.add_argument('--min-rating', type=float, default=1)
+    parser.add_argument('--chunksize', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--k', type=int, default=NEIGHBORS_K, help='neighbors kept per anime')
+    parser.add_argument('--block', type=int, default=512, help='animes per block, memory per worker is block x N floats')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--dtype', default='float16', choices=['float16', 'float32'])
+    parser.add_argument('--out', default=MODEL_DIR)
+    args = parser.parse_args()
+
+    started = time.time()
+    columns = [args.user_column, args.item_column, args.rating_column]
+    if(args.csv):
+        chunks = pd.read_csv(args.csv, usecols=columns, chunksize=args.chunksize)
+    else:
+        from src.db import get_engine
+        chunks = pd.read_sql(args.sql, con=get_engine(), chunksize=args.chunksize)
+
+    ratings, ids = read_ratings(chunks, *columns, args.min_rating)
+    neighbors = build(ratings, ids, args.k, args.block, args.workers, dtype=args.dtype)
+    save(neighbors, args.out)
+    print(f'wrote top {neighbors.k} neighbors of {len(ids)} animes to {args.out} in {time.time() - started:.0f}s')
@@ -0,0 +1,136 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from src.mal import MALClient
+
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', 256))
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', 300)) # seconds
+USER_CACHE_DIR = os.getenv('USER_CACHE_DIR') # optional on-disk tier, disabled when unset
+
+
+class TTLCache():
+    """
+      Size-bounded LRU cache whose entries expire after `ttl` seconds.
+
+      --
+
+      get:
+        value if present and fresh, else None. Counts hits and misses.
+
+      peek:
+        (value, fresh) even for expired entries that have not been evicted yet, so they can be revalidated.
+    """
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict() # key -> (expires, value)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value, fresh = self.peek(key)
+        with self.lock:
+            if(fresh):
+                self.hits += 1
+                return value
+            self.misses += 1
+            return None
+
+    def peek(self, key):
+        with self.lock:
+            if(key not in self.entries):
+                return None, False
+            self.entries.move_to_end(key)
+            expires, value = self.entries[key]
+            return value, expires > time.monotonic()
+
+    def set(self, key, value, ttl: float = None):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def pop(self, key):
+        with self.lock:
+            return self.entries.pop(key, (None, None))[1]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries)}
+
+
+class UserListCache():
+    """
+      Cache in front of MALClient.get_animelist for /categories/user.
+
+      --
+
+      1. in-process TTLCache, fresh entries skip the network entirely.
+      2. optional on-disk tier (USER_CACHE_DIR), shared by workers and surviving restarts.
+      3. stale entries with an ETag / Last-Modified are revalidated with a conditional request,
+         a 304 keeps the cached list for another TTL.
+    """
+    def __init__(self, client: MALClient, maxsize: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL, directory: str = USER_CACHE_DIR):
+        self.client = client
+        self.ttl = ttl
+        self.memory = TTLCache(maxsize, ttl)
+        self.directory = directory
+        if(directory):
+            os.makedirs(directory, exist_ok=True)
+        self.counts = {'memory_hits': 0, 'disk_hits': 0, 'revalidated': 0, 'misses': 0}
+
+    async def get_animelist(self, user: str):
+        key = user.casefold() # MAL usernames are case-insensitive
+        entry, fresh = self.memory.peek(key)
+        if(fresh):
+            self.counts['memory_hits'] += 1
+            return entry['animes']
+
+        if(entry is None and self.directory):
+            entry = await asyncio.to_thread(self.read, key)
+            if(entry is not None and time.time() - entry['fetched'] < self.ttl):
+                self.counts['disk_hits'] += 1
+                self.memory.set(key, entry, self.ttl - (time.time() - entry['fetched']))
+                return entry['animes']
+
+        result = await self.client.get_animelist(user, entry['validators'] if entry else None)
+        if(result is None): # 304, the cached list is still current
+            self.counts['revalidated'] += 1
+            entry['fetched'] = time.time()
+        else:
+            self.counts['misses'] += 1
+            animes, validators = result
+            entry = {'user': user, 'fetched': time.time(), 'validators': validators, 'animes': animes}
+
+        self.memory.set(key, entry)
+        if(self.directory):
+            await asyncio.to_thread(self.write, key, entry)
+        return entry['animes']
+
+    def path(self, key: str):
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + '.json')
+
+    def read(self, key: str):
+        try:
+            with open(self.path(key)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def write(self, key: str, entry: dict):
+        path = self.path(key)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp, path)
+
+    def stats(self):
+        return {**self.counts, 'size': len(self.memory)}
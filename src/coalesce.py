@@ -0,0 +1,49 @@
+import asyncio
+import os
+from src.cache import TTLCache
+
+RESULT_CACHE_SIZE = int(os.getenv('RESULT_CACHE_SIZE', 512))
+RESULT_CACHE_TTL = float(os.getenv('RESULT_CACHE_TTL', 300)) # seconds
+
+
+class SingleFlight():
+    """
+      Runs one computation per key at a time and shares its result.
+
+      --
+
+      Concurrent callers with the same key await the computation already in flight instead of
+      starting their own. Callers arriving after it finished get the result from a TTLCache
+      until it expires. Failures are not cached, the next caller tries again.
+
+      The computation runs as its own task, so a caller disconnecting does not cancel it for the others.
+    """
+    def __init__(self, maxsize: int = RESULT_CACHE_SIZE, ttl: float = RESULT_CACHE_TTL):
+        self.results = TTLCache(maxsize, ttl)
+        self.inflight = {} # key -> asyncio.Task
+        self.coalesced = 0
+
+    async def do(self, key, compute):
+        '''
+        Result of `await compute()` for key, computed at most once among concurrent callers.
+        '''
+        result = self.results.get(key)
+        if(result is not None):
+            return result
+
+        task = self.inflight.get(key)
+        if(task is None):
+            task = asyncio.ensure_future(compute())
+            self.inflight[key] = task
+            task.add_done_callback(lambda task: self.finish(key, task))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def finish(self, key, task: asyncio.Task):
+        del self.inflight[key]
+        if(not task.cancelled() and task.exception() is None):
+            self.results.set(key, task.result())
+
+    def stats(self):
+        return {**self.results.stats(), 'coalesced': self.coalesced, 'inflight': len(self.inflight)}
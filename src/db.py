@@ -0,0 +1,30 @@
+import os
+import threading
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 5))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800)) # seconds, hosted postgres drops idle connections
+
+engine: Engine = None
+engine_lock = threading.Lock()
+
+def get_engine():
+    '''
+    The process-wide SQLAlchemy engine. Its connection pool is shared by the catalog load,
+    the /genres query and the relations writer.
+    '''
+    global engine
+    with engine_lock:
+        if(engine is None):
+            url = os.getenv("SQL_ALCHEMY_CRED")
+            if(url.startswith('sqlite')): # local stand-in, sqlite picks its own pool
+                engine = create_engine(url)
+            else:
+                engine = create_engine(url, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW,
+                                       pool_recycle=DB_POOL_RECYCLE, pool_pre_ping=True)
+    return engine
@@ -0,0 +1,129 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from src.metrics import Histogram
+
+EXECUTOR_KIND = os.getenv('EXECUTOR_KIND', 'thread') # 'thread' or 'process'
+EXECUTOR_WORKERS = int(os.getenv('EXECUTOR_WORKERS', min(4, os.cpu_count() or 1)))
+EXECUTOR_QUEUE = int(os.getenv('EXECUTOR_QUEUE', 32)) # calls allowed to wait for a worker before rejecting
+
+
+wait_seconds = Histogram('executor_wait_seconds', 'Time calls waited for a pool worker.', ('stage',))
+run_seconds = Histogram('executor_run_seconds', 'Time calls ran on a pool worker.', ('stage',))
+
+
+class ExecutorSaturated(Exception):
+    def __init__(self, stage: str):
+        self.stage = stage
+        super().__init__(f'too many pending {stage} requests')
+
+
+class StageTimes():
+    """
+      Running totals of how long calls of one stage waited for a worker and then ran, in seconds.
+    """
+    def __init__(self):
+        self.calls = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.run_total = 0.0
+        self.run_max = 0.0
+
+    def add(self, wait: float, run: float):
+        self.calls += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+        self.run_total += run
+        self.run_max = max(self.run_max, run)
+
+    def stats(self):
+        return {
+            'calls': self.calls,
+            'wait_avg': self.wait_total / self.calls if self.calls else 0.0,
+            'wait_max': self.wait_max,
+            'run_avg': self.run_total / self.calls if self.calls else 0.0,
+            'run_max': self.run_max,
+        }
+
+
+target = None # the Recommend instance of a process pool worker
+
+def init_worker(factory):
+    global target
+    target = factory()
+
+def call(instance, method: str, args: tuple, submitted: float):
+    started = time.monotonic()
+    result = getattr(instance if instance is not None else target, method)(*args)
+    return result, submitted, started, time.monotonic()
+
+
+class RecommendExecutor():
+    """
+      Runs the synchronous Recommend / Search work off the event loop, in a bounded pool.
+
+      --
+
+      kind:
+        'thread': one Recommend shared by a thread pool (NumPy / SciPy release the GIL in the heavy parts).
+        'process': every pool process builds its own Recommend from `factory`; the model arrays are
+        mmapped (src.artifacts), so the processes share their pages.
+
+      At most workers + queue_size calls are pending at once, further calls raise ExecutorSaturated
+      right away instead of queueing without bound. Wait (submitted -> started) and run times are kept per stage.
+    """
+    def __init__(self, factory, kind: str = EXECUTOR_KIND, workers: int = EXECUTOR_WORKERS, queue_size: int = EXECUTOR_QUEUE):
+        self.kind = kind
+        self.capacity = workers + queue_size
+        self.pending = 0
+        self.rejected = 0
+        self.times = {}
+        self.lock = threading.Lock()
+
+        if(kind == 'process'):
+            self.instance = None
+            self.pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=init_worker, initargs=(factory,))
+        elif(kind == 'thread'):
+            self.instance = factory()
+            self.pool = ThreadPoolExecutor(workers, thread_name_prefix='recommend')
+        else:
+            raise ValueError(f"EXECUTOR_KIND must be 'thread' or 'process', not {kind!r}")
+
+    async def run(self, stage: str, method: str, *args):
+        '''
+        Result of Recommend.<method>(*args) computed on the pool. Raises ExecutorSaturated when the queue is full.
+        '''
+        with self.lock:
+            if(self.pending >= self.capacity):
+                self.rejected += 1
+                raise ExecutorSaturated(stage)
+            self.pending += 1
+        try:
+            future = self.pool.submit(call, self.instance, method, args, time.monotonic())
+            result, submitted, started, finished = await asyncio.wrap_future(future)
+        finally:
+            with self.lock:
+                self.pending -= 1
+
+        with self.lock:
+            self.times.setdefault(stage, StageTimes()).add(started - submitted, finished - started)
+        wait_seconds.observe(started - submitted, stage)
+        run_seconds.observe(finished - started, stage)
+        return result
+
+    def stats(self):
+        with self.lock:
+            return {
+                'kind': self.kind,
+                'pending': self.pending,
+                'capacity': self.capacity,
+                'rejected': self.rejected,
+                'stages': {stage: times.stats() for stage, times in self.times.items()},
+            }
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
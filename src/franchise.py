@@ -0,0 +1,124 @@
+import queue
+import threading
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from src.db import get_engine
+from src.log import get_logger, fields
+from src.metrics import timed
+
+log = get_logger(__name__)
+
+
+def parse_relations(relations: str):
+    '''
+    '1, 22, 333' --> [1, 22, 333]
+    '''
+    if(not isinstance(relations, str)):
+        return []
+    return [int(relation) for relation in relations.split(', ') if relation.strip()]
+
+
+class RelationWriter():
+    """
+      Writes new / updated rows of the relations table on a background thread, so requests never wait on it.
+    """
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name='relations-writer', daemon=True)
+        self.thread.start()
+
+    def put(self, source_id: int, relations: list, exists: bool):
+        self.queue.put((source_id, ', '.join(str(x) for x in relations), exists))
+
+    def run(self):
+        while True:
+            source_id, relations, exists = self.queue.get()
+            try:
+                with timed('relations_write'), get_engine().begin() as conn: # pooled connection, committed on exit
+                    if(exists):
+                        conn.execute(text('UPDATE relations SET relations = :relations WHERE source_id = :source_id'), {'relations': relations, 'source_id': source_id})
+                    else:
+                        conn.execute(text('INSERT INTO relations (source_id, relations) VALUES (:source_id, :relations)'), {'relations': relations, 'source_id': source_id})
+                log.debug('saved relations', extra=fields(source_id=source_id, relations=relations))
+            except SQLAlchemyError:
+                log.exception('could not save relations', extra=fields(source_id=source_id))
+            finally:
+                self.queue.task_done()
+
+
+class FranchiseGraph():
+    """
+      In-memory copy of the relations table: which franchise (source material) every anime belongs to,
+      and which anime of each franchise is in the catalog.
+
+      --
+
+      source_ids:
+        anime_id -> source_id of its franchise.
+
+      members:
+        source_id -> anime_ids of the franchise, in the order they were added.
+
+      representatives:
+        source_id -> first anime_id of the franchise that is in the catalog.
+
+      New relations update the graph right away and are written back to the database by a RelationWriter.
+    """
+    def __init__(self, relations: pd.DataFrame, catalog_ids, writer: RelationWriter = None):
+        self.catalog = {int(id) for id in catalog_ids}
+        self.source_ids = {}
+        self.members = {}
+        self.representatives = {}
+        self.lock = threading.Lock()
+        self.writer = writer
+
+        for source_id, members in zip(relations['source_id'], relations['relations']):
+            self.merge(int(source_id), parse_relations(members))
+
+    @classmethod
+    def load(cls, engine, catalog_ids):
+        relations = pd.read_sql('SELECT source_id, relations FROM relations', con=engine)
+        return cls(relations, catalog_ids, RelationWriter())
+
+    def in_catalog(self, id: int):
+        return int(id) in self.catalog
+
+    def source_of(self, id: int):
+        '''
+        source_id of the franchise of `id`, None if it is not in the relations table.
+        '''
+        return self.source_ids.get(int(id))
+
+    def representative(self, id: int):
+        '''
+        The anime of the franchise of `id` that is in the catalog, None if unknown.
+        '''
+        source_id = self.source_of(id)
+        if(source_id is None):
+            return None
+        return self.representatives.get(source_id)
+
+    def merge(self, source_id: int, relations: list):
+        '''
+        Adds relations to the franchise of source_id, returns the anime_ids that were not in it yet.
+        '''
+        with self.lock:
+            members = self.members.setdefault(source_id, [])
+            added = [id for id in dict.fromkeys(relations) if id not in members]
+            members.extend(added)
+            for id in added:
+                self.source_ids.setdefault(id, source_id)
+                if(source_id not in self.representatives and id in self.catalog):
+                    self.representatives[source_id] = id
+        return added
+
+    def add(self, source_id: int, relations: list):
+        '''
+        Records a franchise found through Jikan and saves it in the background.
+        '''
+        exists = source_id in self.members
+        added = self.merge(source_id, relations)
+        if(added and self.writer is not None):
+            self.writer.put(source_id, self.members[source_id], exists)
+        return added
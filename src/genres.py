@@ -0,0 +1,163 @@
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from src.records import RecordStore
+
+GENRE_CACHE_SIZE = int(os.getenv('GENRE_CACHE_SIZE', 128))
+
+MIN_GENRE_SCORE = 7.0
+GENRE_RESULTS = 100
+
+
+class GenreSimilarity():
+    """
+      Genre cosine similarities computed on demand from the sparse TF-IDF rows.
+
+      --
+
+      TfidfVectorizer already L2-normalises every row, so the cosine similarity of two animes
+      is the dot product of their rows and one seed against the whole catalog is one sparse product.
+      The similarity vectors of the most recently used seeds are kept in a small LRU cache.
+    """
+    def __init__(self, tfidf_matrix: sparse.spmatrix, ids: np.ndarray, cache_size: int = GENRE_CACHE_SIZE):
+        self.matrix = sparse.csr_matrix(tfidf_matrix, dtype=np.float32)
+        self.ids = ids
+        self.rows = {int(id): i for i, id in enumerate(ids)}
+        self.index = pd.Index(ids)
+
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def positions(self, ids):
+        '''
+        Rows of the TF-IDF matrix for each anime_id, -1 for animes not in the catalog.
+        '''
+        return self.index.get_indexer(np.asarray(ids))
+
+    def seed_similarities(self, id):
+        '''
+        Similarity of every anime in the catalog to `id`, aligned with self.ids.
+        '''
+        id = int(id)
+        with self.lock:
+            if(id in self.cache):
+                self.cache.move_to_end(id)
+                return self.cache[id]
+
+        row = self.matrix[self.rows[id]]
+        similarities = (self.matrix @ row.T).toarray().ravel()
+
+        if(self.cache_size > 0):
+            with self.lock:
+                self.cache[id] = similarities
+                if(len(self.cache) > self.cache_size):
+                    self.cache.popitem(last=False)
+        return similarities
+
+    def similarities(self, id, others):
+        '''
+        Similarities of the animes in `others` to `id`, aligned with `others` (0 for animes not in the catalog).
+        '''
+        positions = self.positions(others)
+        return np.where(positions >= 0, self.seed_similarities(id)[positions], 0)
+
+    def pairwise(self, ids, others):
+        '''
+        (len(ids), len(others)) similarities of every anime in `others` to every anime in `ids`
+        from one sparse product, 0 where either is not in the catalog.
+        '''
+        seeds = self.positions(ids)
+        positions = self.positions(others)
+        matrix = (self.matrix[np.maximum(seeds, 0)] @ self.matrix[np.maximum(positions, 0)].T).toarray()
+        matrix[seeds < 0] = 0
+        matrix[:, positions < 0] = 0
+        return matrix
+
+    def profile_similarities(self, profile, ids):
+        '''
+        Cosine similarity of a (1, vocabulary) genre profile to the animes in `ids`, aligned with `ids`
+        (0 for animes not in the catalog).
+        '''
+        profile = np.asarray(profile, dtype=np.float32).ravel()
+        norm = np.linalg.norm(profile)
+        if(norm == 0):
+            return np.zeros(len(ids), dtype=np.float32)
+
+        positions = self.positions(ids)
+        similarities = self.matrix[np.maximum(positions, 0)] @ (profile / norm) # rows are already unit length
+        return np.where(positions >= 0, similarities, 0)
+
+
+def genre_token(genre: str):
+    '''
+    Key of a genre in the index, i.e. 'Sci-Fi', 'Sci_Fi' and 'sci_fi' are the same genre.
+    '''
+    return genre.replace('-', '_').casefold()
+
+
+class GenreIndex():
+    """
+      Inverted index of exact genre tokens for /categories/genre.
+
+      --
+
+      postings:
+        genre -> row positions in anime_df of every anime with that genre, highest score first.
+
+      members:
+        genre -> boolean mask over anime_df rows, for intersecting with the other genres of a query.
+
+      records:
+        RecordStore with the response record of every row (every column but anime_id, missing values as null),
+        selected from the fragments of the catalog's RecordStore.
+    """
+    def __init__(self, anime_df: pd.DataFrame, records: RecordStore):
+        self.scores = anime_df['score'].to_numpy(dtype=np.float32)
+        by_score = np.argsort(-self.scores, kind='stable')
+
+        tokens = [[genre_token(genre) for genre in genres.split()] if isinstance(genres, str) else [] for genres in anime_df['genres']]
+        rows = {}
+        for row, genres in enumerate(tokens):
+            for genre in genres:
+                rows.setdefault(genre, []).append(row)
+
+        self.members = {}
+        for genre, genre_rows in rows.items():
+            mask = np.zeros(len(anime_df), dtype=bool)
+            mask[genre_rows] = True
+            self.members[genre] = mask
+        self.postings = {genre: by_score[mask[by_score]] for genre, mask in self.members.items()}
+        self.all_rows = by_score
+
+        fields = [column for column in anime_df.columns if column != 'anime_id']
+        self.records = records.select(fields, {field: np.flatnonzero(anime_df[field].isna().to_numpy()) for field in fields})
+
+    def query(self, genre_list: list, limit: int = GENRE_RESULTS, min_score: float = MIN_GENRE_SCORE):
+        '''
+        Rows of the animes having every genre in genre_list, highest score first, stopping
+        at the first score below min_score or after limit results.
+        '''
+        genres = {genre_token(genre) for genre in genre_list}
+        if(any(genre not in self.postings for genre in genres)):
+            return np.array([], dtype=np.int64)
+
+        # walk the shortest posting list in score order and check membership in the others
+        genres = sorted(genres, key=lambda genre: len(self.postings[genre]))
+        rows = self.postings[genres[0]] if genres else self.all_rows
+        rows = rows[:np.count_nonzero(self.scores[rows] >= min_score)] # postings are sorted by score
+
+        results = []
+        found = 0
+        for start in range(0, len(rows), limit):
+            chunk = rows[start:start + limit]
+            for genre in genres[1:]:
+                chunk = chunk[self.members[genre][chunk]]
+            results.append(chunk)
+            found += len(chunk)
+            if(found >= limit):
+                break
+        return np.concatenate(results)[:limit] if results else rows
@@ -0,0 +1,223 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import httpx
+from dotenv import load_dotenv
+from src.log import get_logger, fields
+
+load_dotenv()
+
+log = get_logger(__name__)
+
+JIKAN_API_URL = os.getenv('JIKAN_API_URL', 'https://api.jikan.moe/v4') # point at a local fake server to run without Jikan
+JIKAN_RATE = float(os.getenv('JIKAN_RATE', 1)) # requests per second, Jikan allows 60 / minute
+JIKAN_BURST = int(os.getenv('JIKAN_BURST', 3)) # and 3 / second
+JIKAN_CONCURRENCY = int(os.getenv('JIKAN_CONCURRENCY', 3))
+JIKAN_TIMEOUT = float(os.getenv('JIKAN_TIMEOUT', 10))
+JIKAN_RETRIES = int(os.getenv('JIKAN_RETRIES', 3))
+JIKAN_CACHE_PATH = os.getenv('JIKAN_CACHE_PATH', 'jikan_cache.sqlite3')
+JIKAN_CACHE_TTL = float(os.getenv('JIKAN_CACHE_TTL', 7 * 24 * 3600)) # seconds
+RELATION_DEPTH = int(os.getenv('RELATION_DEPTH', 10))
+
+BLACKLIST = ['Other', 'Summary', 'Character'] # relations that are often irrelevant
+
+
+class JikanError(Exception):
+    pass
+
+
+class TokenBucket():
+    """
+      Allows `rate` acquisitions per second on average, with bursts of up to `capacity`.
+    """
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock: # waiters are served in order
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if(self.tokens >= 1):
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class RelationStore():
+    """
+      Persistent memo of Jikan responses (sqlite), keyed by API path. 404s are stored as empty data.
+    """
+    def __init__(self, path: str = JIKAN_CACHE_PATH, ttl: float = JIKAN_CACHE_TTL):
+        self.ttl = ttl
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS responses (path TEXT PRIMARY KEY, fetched REAL, data TEXT)')
+        self.conn.commit()
+        self.lock = threading.Lock()
+
+    def get(self, path: str):
+        with self.lock:
+            row = self.conn.execute('SELECT fetched, data FROM responses WHERE path = ?', [path]).fetchone()
+        if(row is None or time.time() - row[0] > self.ttl):
+            return None
+        return json.loads(row[1])
+
+    def set(self, path: str, data: list):
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?)', [path, time.time(), json.dumps(data)])
+            self.conn.commit()
+
+
+class JikanResolver():
+    """
+      Resolves an anime to its source material and the anime adaptations of it through the Jikan API.
+
+      --
+
+      Runs its own event loop on a background thread so the sync pipeline (src/user.py) and async code
+      share one client, one token bucket rate limiter and one concurrency bound across every request.
+
+      source:
+        id of the source material (oldest adaptation source), -1 for anime originals.
+
+      relations:
+        {'source_id', 'relations'}: the anime adaptations of the source material, or for anime originals the chain
+        of related animes (at most RELATION_DEPTH deep) with the negated id of the anime as source_id.
+    """
+    def __init__(self, base_url: str = JIKAN_API_URL, store: RelationStore = None, rate: float = JIKAN_RATE,
+                 burst: int = JIKAN_BURST, concurrency: int = JIKAN_CONCURRENCY, depth: int = RELATION_DEPTH,
+                 retries: int = JIKAN_RETRIES, transport: httpx.AsyncBaseTransport = None):
+        self.store = store if store is not None else RelationStore()
+        self.depth = depth
+        self.retries = retries
+        self.client = httpx.AsyncClient(base_url=base_url, timeout=httpx.Timeout(JIKAN_TIMEOUT),
+                                        transport=transport) # stub transport in tests, the network otherwise
+        self.bucket = TokenBucket(rate, burst)
+        self.semaphore = asyncio.Semaphore(concurrency)
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name='jikan', daemon=True)
+        self.thread.start()
+
+    def run(self, coro):
+        '''
+        Runs a coroutine of this resolver from sync code and waits for its result.
+        '''
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    async def fetch(self, path: str):
+        '''
+        'data' of a Jikan response, memoised. Raises JikanError once retries run out.
+        '''
+        data = self.store.get(path)
+        if(data is not None):
+            return data
+
+        for attempt in range(self.retries + 1):
+            async with self.semaphore:
+                await self.bucket.acquire()
+                try:
+                    r = await self.client.get(path)
+                except httpx.TransportError as e:
+                    r = None
+                    error = repr(e)
+            if(r is not None):
+                if(r.status_code == 404):
+                    data = []
+                    break
+                if(r.status_code == 200):
+                    data = r.json()['data']
+                    break
+                error = f'Jikan returned {r.status_code} for {path}'
+                if(r.status_code != 429 and r.status_code < 500):
+                    raise JikanError(error)
+            if(attempt == self.retries):
+                raise JikanError(error)
+            log.warning('retrying Jikan request', extra=fields(path=path, attempt=attempt + 1, error=error))
+            await asyncio.sleep(2 ** attempt)
+
+        self.store.set(path, data)
+        return data
+
+    async def source(self, id: int):
+        data = await self.fetch(f'/anime/{id}/relations')
+        for relation in data:
+            if(relation['relation'] == 'Adaptation'):
+                ## can be multiple source materials - i.e. Classroom of the Elite has the LN (89357) and the newer manga (96371)
+                    # Look for the lowest id which ensures that it is the true source material (oldest)
+                return min(entry['mal_id'] for entry in relation['entry'])
+
+        # no adaptation --> anime original
+        return -1
+
+    async def relation_chain(self, id: int):
+        '''
+        Follows the first non-blacklisted related anime not seen yet, at most `depth` animes deep.
+        '''
+        chain = [id]
+        while len(chain) < self.depth:
+            try:
+                data = await self.fetch(f'/anime/{chain[-1]}/relations')
+            except JikanError:
+                break
+
+            next_id = None
+            for relation in data:
+                if(relation['relation'] in BLACKLIST):
+                    continue
+                for entry in relation['entry']:
+                    if(entry['mal_id'] not in chain and entry['type'] == 'anime'):
+                        next_id = entry['mal_id']
+                        break
+                if(next_id is not None):
+                    break
+            if(next_id is None):
+                break
+            chain.append(next_id)
+        return chain
+
+    async def relations(self, id: int):
+        source_id = await self.source(id)
+        if(source_id == -1): # anime original / no source found
+            chain = await self.relation_chain(id)
+            return {'source_id': -chain[0], 'relations': chain}
+
+        relations = []
+        for relation in await self.fetch(f'/manga/{source_id}/relations'):
+            if(relation['relation'] == 'Adaptation'):
+                relations = [entry['mal_id'] for entry in relation['entry'] if entry['type'] == 'anime']
+                break
+        return {'source_id': source_id, 'relations': relations}
+
+    async def relations_many(self, ids: list):
+        '''
+        relations() of every id concurrently, within the shared rate limit. None for the ids that failed.
+        '''
+        results = await asyncio.gather(*(self.relations(id) for id in ids), return_exceptions=True)
+        return [None if isinstance(result, Exception) else result for result in results]
+
+    def close(self):
+        self.run(self.client.aclose())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+resolver: JikanResolver = None
+resolver_lock = threading.Lock()
+
+def get_resolver():
+    '''
+    The process-wide resolver, created on first use.
+    '''
+    global resolver
+    with resolver_lock:
+        if(resolver is None):
+            resolver = JikanResolver()
+    return resolver
@@ -0,0 +1,79 @@
+import json
+import logging
+import os
+import random
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json') # 'json' or 'text'
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', 1.0)) # share of DEBUG / INFO records kept, warnings and errors are always kept
+
+ROOT_LOGGER = 'src'
+
+
+class JSONFormatter(logging.Formatter):
+    """
+      One JSON object per line: time, level, logger, message and the record's `fields`.
+    """
+    def format(self, record: logging.LogRecord):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            **getattr(record, 'fields', {}),
+        }
+        if(record.exc_info):
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    def format(self, record: logging.LogRecord):
+        fields = getattr(record, 'fields', {})
+        line = super().format(record)
+        return line + ''.join(f' {key}={value}' for key, value in fields.items())
+
+
+class SampleFilter(logging.Filter):
+    """
+      Keeps every warning / error but only `rate` of the records below, so busy workers
+      do not spend their time logging the hot paths.
+    """
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord):
+        return record.levelno >= logging.WARNING or self.rate >= 1 or random.random() < self.rate
+
+
+def configure():
+    logger = logging.getLogger(ROOT_LOGGER)
+    if(logger.handlers):
+        return
+    handler = logging.StreamHandler()
+    handler.setFormatter(JSONFormatter() if LOG_FORMAT == 'json' else TextFormatter())
+    logger.addHandler(handler)
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False # uvicorn configures the root logger on its own
+
+
+def get_logger(name: str):
+    '''
+    Logger of a src module, i.e. get_logger(__name__).
+    '''
+    configure()
+    logger = logging.getLogger(name)
+    if(LOG_SAMPLE_RATE < 1 and not any(isinstance(f, SampleFilter) for f in logger.filters)):
+        logger.addFilter(SampleFilter(LOG_SAMPLE_RATE))
+    return logger
+
+
+def fields(**values):
+    '''
+    Structured fields of a record: log.info('message', extra=fields(user=user, animes=10)).
+    '''
+    return {'fields': values}
@@ -0,0 +1,123 @@
+import asyncio
+import os
+import httpx
+from dotenv import load_dotenv
+from src.log import get_logger, fields
+
+load_dotenv()
+
+log = get_logger(__name__)
+
+MAL_API_URL = os.getenv('MAL_API_URL', 'https://api.myanimelist.net/v2') # point at a local stub server to run without MAL
+MAL_TIMEOUT = float(os.getenv('MAL_TIMEOUT', 10))
+MAL_RETRIES = int(os.getenv('MAL_RETRIES', 3))
+MAL_BACKOFF = float(os.getenv('MAL_BACKOFF', 0.5))
+MAL_MAX_CONNECTIONS = int(os.getenv('MAL_MAX_CONNECTIONS', 20))
+MAL_MAX_RETRY_AFTER = float(os.getenv('MAL_MAX_RETRY_AFTER', MAL_TIMEOUT)) # seconds, a longer Retry-After fails the request instead
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class MALError(Exception):
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class MALClient():
+    """
+      Async MyAnimeList API client sharing one connection pool across requests.
+
+      --
+
+      get_animelist:
+        every entry of a user's list (all statuses), following the paging links.
+        Supports conditional requests so a cached list can be revalidated.
+
+      Requests time out after MAL_TIMEOUT seconds. Connection errors, timeouts, 429 and 5xx responses
+      are retried up to MAL_RETRIES times with exponential backoff (or the Retry-After MAL sends).
+      A Retry-After above MAL_MAX_RETRY_AFTER raises MALError right away, since every coalesced caller would wait on it.
+    """
+    def __init__(self, client_id: str = None, base_url: str = MAL_API_URL, timeout: float = MAL_TIMEOUT,
+                 retries: int = MAL_RETRIES, backoff: float = MAL_BACKOFF, max_connections: int = MAL_MAX_CONNECTIONS,
+                 max_retry_after: float = MAL_MAX_RETRY_AFTER, transport: httpx.AsyncBaseTransport = None):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_retry_after = max_retry_after
+        self.client = httpx.AsyncClient(
+            base_url=base_url,
+            headers={"X-MAL-CLIENT-ID": client_id or os.getenv("X_MAL_CLIENT_ID") or ''},
+            timeout=httpx.Timeout(timeout),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            transport=transport, # stub transport in tests, the network otherwise
+        )
+
+    async def request(self, url: str, params: dict = None, headers: dict = None):
+        '''
+        GET with retries, returns the 200 or 304 response. Raises MALError once retries run out or on any other error status.
+        '''
+        for attempt in range(self.retries + 1):
+            delay = self.backoff * 2 ** attempt
+            try:
+                r = await self.client.get(url, params=params, headers=headers)
+            except httpx.TransportError as e:
+                if(attempt == self.retries):
+                    raise MALError(502, f'MyAnimeList unreachable: {e!r}')
+            else:
+                if(r.status_code in (200, 304)):
+                    return r
+                if(r.status_code not in RETRY_STATUSES or attempt == self.retries):
+                    raise MALError(r.status_code, f'MyAnimeList returned {r.status_code} for {r.url}')
+                if('Retry-After' in r.headers and r.headers['Retry-After'].isdigit()):
+                    delay = float(r.headers['Retry-After'])
+                    if(delay > self.max_retry_after):
+                        raise MALError(r.status_code, f'MyAnimeList asked to retry {r.url} in {delay:.0f}s')
+            log.warning('retrying MyAnimeList request', extra=fields(url=url, attempt=attempt + 1, delay=delay))
+            await asyncio.sleep(delay)
+
+    async def get(self, url: str, params: dict = None):
+        return (await self.request(url, params=params)).json()
+
+    async def get_animelist(self, user: str, validators: dict = None):
+        '''
+        The user's whole list sorted by list score, with genres and list_status of every entry.
+
+        With the validators (ETag / Last-Modified) of a previous fetch, returns None if MAL answers 304 Not Modified.
+        Otherwise returns (list, validators), the validators being empty unless the list fit in one page,
+        since a 304 on the first page says nothing about the next ones.
+        '''
+        params = {'fields': 'id,title,genres,list_status', 'limit': 1000, 'sort': 'list_score'}
+        headers = {}
+        if(validators):
+            if('etag' in validators):
+                headers['If-None-Match'] = validators['etag']
+            if('last_modified' in validators):
+                headers['If-Modified-Since'] = validators['last_modified']
+
+        response = await self.request(f'/users/{user}/animelist', params=params, headers=headers)
+        if(response.status_code == 304):
+            return None
+
+        r = response.json()
+        animes = r['data']
+        validators = {}
+        if('ETag' in response.headers):
+            validators['etag'] = response.headers['ETag']
+        if('Last-Modified' in response.headers):
+            validators['last_modified'] = response.headers['Last-Modified']
+
+        while 'paging' in r and 'next' in r['paging']:
+            validators = {}
+            r = await self.get(r['paging']['next'])
+            animes.extend(r['data'])
+        return animes, validators
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+def completed(animes: list):
+    '''
+    Entries of the list the user has completed, in the same order.
+    '''
+    return [anime for anime in animes if anime['list_status']['status'] == 'completed']
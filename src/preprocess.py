@@ -1,54 +1,46 @@
 import numpy as np
 import pandas as pd
-from sqlalchemy import create_engine
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.feature_extraction.text import TfidfVectorizer
-from typing import List
 from src.user import getData
-import os
+from src.similarity import load_neighbors
+from src.genres import GenreSimilarity, GenreIndex
+from src.scoring import ScoringEngine
+from src.records import RecordStore, anime_records
+from src.franchise import FranchiseGraph
+from src.db import get_engine
+from src.snapshot import load_catalog
+from src.log import get_logger, fields
+from src.metrics import timed
 from dotenv import load_dotenv, dotenv_values
 
+log = get_logger(__name__)
+
 class DataFrames:
     
     def __init__(self):
         load_dotenv()
 
-        self.engine = create_engine(os.getenv("SQL_ALCHEMY_CRED"))
-        self.anime_df = pd.read_sql("select * from animes", con=self.engine)
-
-        # Scores only go from [-1, 10]
-        self.anime_df['score'] = self.anime_df['score'].astype('float16')
-        # Anime_id goes from [1, 55647]
-        self.anime_df['anime_id'] = self.anime_df['anime_id'].astype('int32')
+        self.engine = get_engine() # pooled, shared with the relations writer
+        catalog = load_catalog(self.engine) ## preprocessed catalog snapshot, rebuilt from SQL only when missing or stale
+        self.anime_df = catalog.anime_df
 
-        self.anime_df['genres'] = self.anime_df['genres'].str.replace(',', '')
-        self.anime_df['genres'] = self.anime_df['genres'].str.replace('-','_')
-        self.anime_df['genres'] = self.anime_df['genres'].str.replace('(','')
-        self.anime_df['genres'] = self.anime_df['genres'].str.replace(')', '')
+        self.scoring = ScoringEngine(self.anime_df) ## anime_id -> row index + vectorized ranking
+        self.records = RecordStore.from_records(anime_records(self.anime_df)) ## every anime's recommendation payload, pre-encoded as JSON
+        self.genre_index = GenreIndex(self.anime_df, self.records) ## exact genre -> animes by score, for /categories/genre, sharing the encoded records
+        self.franchise = FranchiseGraph.load(self.engine, self.anime_df['anime_id']) ## relations table, resolves watched animes to the catalog
 
-        self.tfidf = TfidfVectorizer()
-        tfidf_matrix = self.tfidf.fit_transform(self.anime_df['genres'])
-        cosine_sim_genres = cosine_similarity(tfidf_matrix,tfidf_matrix)
-        self.cosine_sim_df = pd.DataFrame(cosine_sim_genres, index = self.anime_df['anime_id'], columns = self.anime_df['anime_id'])
+        self.tfidf = catalog.tfidf
+        self.genre_similarity = GenreSimilarity(catalog.tfidf_matrix, self.anime_df['anime_id'].to_numpy()) ## genre cosine similarities, computed per seed instead of N x N up front
 
-        self.item_similarity_df = pd.read_csv("Data.csv", index_col=0) ## Cosine similarities between each anime.
-        print(self.item_similarity_df)
+        self.item_neighbors = load_neighbors() ## Top-k most similar animes of each anime (mmapped), from src.build_similarity or derived from Data.csv on first boot.
+        log.info('model loaded', extra=fields(animes=len(self.anime_df), neighbors=self.item_neighbors.k))
     
     def getUserData(self, userlist, allAnimes):
         '''
-        gets user data, creates the user_profile as instance variable, returns topAnimes and allAnimes
+        gets user data, returns topAnimes, the anime_ids of the whole list, their weights and the user's genre profile
         '''
-        data = getData(userlist, allAnimes) # returns top animes + all animes and their genres
+        data = getData(userlist, allAnimes, self.franchise, self.tfidf, self.item_neighbors) # returns top animes + every anime on the list and the genre profile
         if(data == -1):
             return -1
-        
-        df = data['genres']
-        tfidf_matrix = self.getGenreTFIDF(df)
-    
-        user_profile = tfidf_matrix.mean(axis=0)
-        self.user_profile = np.asarray(user_profile)
-
-        allAnimes: set[int] = set(df['id'])
 
         topAnimes = data['topAnimes']
 
@@ -58,28 +50,14 @@ class DataFrames:
         else:
             weights = data['weights']
 
-        return {'topAnimes': topAnimes, 'allAnimes': allAnimes, 'weights': weights}
-    
-    def getDataFrame(self, animes: List[int]):
-        '''
-        Converts a list of series with anime_ids into a dataframe containing all info of those animes.
-        '''
-        ids = animes
-
-        df = self.anime_df[self.anime_df['anime_id'].isin(ids)]
-        return df
-    
-    def getGenreTFIDF(self, df: pd.DataFrame):
-        '''
-        returns sparse matrix of tfidf on genres
-        '''
-        return self.tfidf.transform(df['genres'])
+        return {'topAnimes': topAnimes, 'allAnimes': data['ids'], 'weights': weights, 'profile': data['profile']}
     
     def getAllGenres(self):
         '''
         For the front end to get all possible genres
         '''
-        genres_df = pd.read_sql("select genre FROM genre_counts", con=self.engine)
+        with timed('db_query'):
+            genres_df = pd.read_sql("select genre FROM genre_counts", con=self.engine)
         genres = genres_df['genre'].tolist()
         return genres
     
@@ -1,9 +1,9 @@
 import numpy as np
-from sklearn.neighbors import NearestNeighbors
 from src.preprocess import DataFrames
 from src.search import Search
-import json
-import pandas as pd
+from src.metrics import timed
+
+SEED_NEIGHBORS = 99 # neighbors of a seed anime that are scored, top 100 counting itself
 
 class Recommend(DataFrames):
 
@@ -12,51 +12,77 @@ class Recommend(DataFrames):
         self.search = Search(self.anime_df)
 
     def get_rec_anime(self, name):
-        id = self.search.get_anime_id(name, 'name')
+        with timed('name_resolution'):
+            id = self.search.get_anime_id(name)
         
         if(id == -1): 
-            return {'contains': self.search.sort_scores(self.search.get_similar_names(name, 'name')), 'fuzzy': self.search.get_fuzz_names(name)}
-
-        s = self.item_similarity_df[str(id)]
-        print(s)
-        s = s.sort_values(ascending=False).iloc[1:100] # top 100 (skipping itself)
-        mapped_values = {}
-        for i, values in s.items():
-            score_weight = (self.anime_df[self.anime_df['anime_id'] == i].iloc[0,4] * .040)
-            rating_sim = values * 1.2
-            genre_sim = self.cosine_sim_df.loc[i, id]
-            total = score_weight + rating_sim + genre_sim
-
-            mapped_values[i] = total
-        
-        recced_animes = pd.Series(mapped_values).sort_values(ascending=False)
-        rec_arr = []
-        for i, values in recced_animes.items():
-            anime = self.anime_df[self.anime_df['anime_id'] == int(i)]
-            d = {
-                 'id': int(anime.anime_id.iloc[0]),
-                 'name': str(anime.name.iloc[0]), 
-                 'image': str(anime.image.iloc[0]),
-                 'english_name': str(anime.english_name.iloc[0]),
-                 'other_name': str(anime.other_name.iloc[0]),
-                 'synopsis': str(anime.synopsis.iloc[0]),
-                 'genres': str(anime.genres.iloc[0]),
-                 'score': float(anime.score.iloc[0])
-                 }
-            rec_arr.append(d)
-        
-        return rec_arr
+            with timed('title_suggestions'):
+                return {'contains': self.search.get_similar_names(name), 'fuzzy': self.search.get_fuzz_names(name)}
+
+        if(id not in self.item_neighbors): # in the catalog but without ratings, nothing to recommend from
+            return self.records.take([])
+
+        with timed('similarity_gather'):
+            neighbor_ids, similarities = self.item_neighbors.neighbors(id, SEED_NEIGHBORS)
+        with timed('genre_scoring'):
+            genre_similarity = self.genre_similarity.similarities(id, neighbor_ids)
+
+        with timed('ranking'):
+            rows = self.scoring.rank(neighbor_ids, similarities, genre_similarity)
+            return self.records.take(rows)
     
+    def get_rec_batch(self, seeds: list):
+        '''
+        One merged ranking for several seeds, each (title or anime_id, weight).
+        Candidates are the union of the seeds' neighbors, their rating and genre similarities
+        are the weighted means over the seeds (0 where an anime is not among a seed's neighbors).
+        '''
+        ids, weights, unresolved = [], [], []
+        with timed('name_resolution'):
+            for seed, weight in seeds:
+                id = self.search.get_anime_id(seed) if isinstance(seed, str) else int(seed)
+                if(id == -1 or id not in self.item_neighbors):
+                    unresolved.append(seed)
+                    continue
+                ids.append(id)
+                weights.append(weight)
+
+        if(not ids):
+            return {'records': self.records.take([]), 'unresolved': unresolved}
+
+        with timed('similarity_gather'):
+            neighbors = self.item_neighbors
+            seed_rows = np.array([neighbors.rows[id] for id in ids], dtype=np.int64)
+            positions = np.asarray(neighbors.positions[seed_rows, :SEED_NEIGHBORS])
+            similarities = np.array(neighbors.similarities[seed_rows, :SEED_NEIGHBORS], dtype=np.float32)
+            similarities[np.isnan(similarities)] = 0
+
+            # (seeds, candidates) similarity matrix over the union of the neighbors, seeds themselves excluded
+            valid = positions >= 0
+            candidates = np.setdiff1d(positions[valid], seed_rows)
+            seed_index = np.nonzero(valid)[0]
+            columns = np.searchsorted(candidates, positions[valid])
+            found = columns < len(candidates)
+            found[found] = candidates[columns[found]] == positions[valid][found]
+
+            matrix = np.zeros((len(ids), len(candidates)), dtype=np.float32)
+            matrix[seed_index[found], columns[found]] = similarities[valid][found]
+
+        weights = np.asarray(weights, dtype=np.float32)
+        weights /= weights.sum()
+        candidate_ids = neighbors.ids[candidates]
+        rating_similarity = weights @ matrix
+        with timed('genre_scoring'):
+            genre_similarity = weights @ self.genre_similarity.pairwise(ids, candidate_ids)
+
+        with timed('ranking'):
+            rows = self.scoring.rank(candidate_ids, rating_similarity, genre_similarity)
+            return {'records': self.records.take(rows), 'unresolved': unresolved}
+
     def get_rec_genre(self, genre_list: list):
-        if('Sci-Fi' in genre_list):
-            index = genre_list.index("Sci-Fi")
-            genre_list[index] = "Sci_Fi"        
-            
-        filtered_animes = self.anime_df[self.anime_df['genres'].apply(lambda x: all(word in x for word in genre_list))]
-        filtered_animes = filtered_animes.sort_values(by=['score'], ascending=False)
-        filtered_animes = filtered_animes.drop('anime_id', axis = 1)
-        filtered_animes = filtered_animes[filtered_animes['score'] >= 7.0].head(100)
-        return json.loads(filtered_animes.to_json(orient="records"))
+        with timed('genre_query'):
+            rows = self.genre_index.query(genre_list)
+            return self.genre_index.records.take(rows)
     
     def get_rec_user(self, userlist, allAnimes):
         data = self.getUserData(userlist, allAnimes)
@@ -69,79 +95,51 @@ class Recommend(DataFrames):
 
         weights = data['weights']
     
-        rating_similarity = self.get_rating_similarity_scores(topAnimes, allAnimes, weights)
-
-        df = self.getDataFrame(rating_similarity.index.to_list())
-        genre_similarity = self.get_genre_similarity_scores(animes=df)
-        mapped_values = {}
-        for i, values in rating_similarity.items():
-            score_weight = (self.anime_df[self.anime_df['anime_id'] == i].iloc[0,4] * .040)
-            rating_sim = values * 1.2
-            genre_sim = genre_similarity.loc[i]
-            total = score_weight + rating_sim + genre_sim
-
-            mapped_values[i] = total
-        
-        recced_animes = pd.Series(mapped_values).sort_values(ascending=False)
-        rec_arr = []
-        for i, values in recced_animes.items():
-            anime = self.anime_df[self.anime_df['anime_id'] == int(i)]
-            d = {
-                 'id': int(anime.anime_id.iloc[0]),
-                 'name': str(anime.name.iloc[0]), 
-                 'image': str(anime.image.iloc[0]),
-                 'english_name': str(anime.english_name.iloc[0]),
-                 'other_name': str(anime.other_name.iloc[0]),
-                 'synopsis': str(anime.synopsis.iloc[0]),
-                 'genres': str(anime.genres.iloc[0]),
-                 'score': float(anime.score.iloc[0])
-                 }
-            rec_arr.append(d)
-        
-        return rec_arr
+        with timed('similarity_gather'):
+            ids, rating_similarity = self.get_rating_similarity_scores(topAnimes, allAnimes, weights)
+
+        with timed('genre_scoring'):
+            genre_similarity = self.get_genre_similarity_scores(ids, data['profile'])
+
+        with timed('ranking'):
+            rows = self.scoring.rank(ids, rating_similarity, genre_similarity)
+            return self.records.take(rows)
     
     
     def get_rating_similarity_scores(self, topAnimes, allAnimes, weights):
         '''
         use user-user similarity to determine similar anime to user's top animes
         '''
-        similar= pd.Series([])
-        for i, id in enumerate(topAnimes):
-            s: pd.Series = self.item_similarity_df[str(id)]
-            print(s)
-            s = s.sort_values(ascending=False)
-            s = s.apply(lambda x: x + np.log(1 + weights[i]))
-            similar = pd.concat([similar, s])
-
-        similar = similar.sort_values(ascending=False)
-        similar = similar[~similar.index.duplicated(keep='first')] # removes duplicate entries, keeping the highest similarity version
-        similar = similar[~similar.index.isin(allAnimes)] # animes that have not been watched
+        neighbors = self.item_neighbors
+        known = [i for i, id in enumerate(topAnimes) if id in neighbors] # seeds without ratings have no neighbors
+        topAnimes = [topAnimes[i] for i in known]
+        weights = np.asarray(weights, dtype=np.float32)[known]
+        seeds = np.array([neighbors.rows[int(id)] for id in topAnimes], dtype=np.int64)
+
+        # (seeds, K) neighbor table rows, each shifted by log(1 + weight) of its seed
+        positions = neighbors.positions[seeds]
+        similarities = neighbors.similarities[seeds].astype(np.float32) + np.log1p(np.asarray(weights, dtype=np.float32)[:len(seeds)])[:, None]
+        similarities[np.isnan(similarities)] = -np.inf
+
+        # scattered into one (seeds, N) matrix and reduced to the highest similarity of each anime across seeds
+        matrix = np.full((len(seeds), len(neighbors.ids)), -np.inf, dtype=np.float32)
+        seed_rows, columns = np.nonzero(positions >= 0)
+        matrix[seed_rows, positions[seed_rows, columns]] = similarities[seed_rows, columns]
+        similar = matrix.max(axis=0, initial=-np.inf)
+
+        watched = np.isin(neighbors.ids, np.asarray(allAnimes, dtype=np.int64))
+        watched |= np.isin(neighbors.ids, np.asarray(topAnimes, dtype=np.int64))
+        similar[watched] = -np.inf # animes that have not been watched
+
+        candidates = np.flatnonzero(np.isfinite(similar))
+        if(len(candidates) > 100):
+            candidates = candidates[np.argpartition(similar[candidates], -100)[-100:]]
+        candidates = candidates[np.argsort(-similar[candidates], kind='stable')]
+
+        return neighbors.ids[candidates], similar[candidates]
     
-        similar = similar.iloc[0:100]
-
-        return similar
-    
-    def get_genre_similarity_scores(self, animes):
+    def get_genre_similarity_scores(self, ids, profile):
         '''
-        use knn with the user's genre profile to find most similar to their genre preferences
+        cosine similarity of the user's genre profile to each anime in ids, aligned with ids
         '''
-
-        tfidf_matrix = self.getGenreTFIDF(animes)
-
-        knn = NearestNeighbors(n_neighbors= tfidf_matrix.shape[0], metric='cosine') # Getting distance for every show in the matrix
-        knn.fit(tfidf_matrix)
-
-
-        distances, indices = knn.kneighbors(self.user_profile)
-       
-        genre_similarity = pd.Series(distances[0], index=animes.iloc[indices[0]].anime_id.values)
-        genre_similarity = genre_similarity.apply(lambda x: 1 - x)
-
-        return genre_similarity
-
-
-
-        
-
-    
-        
\ No newline at end of file
+        return self.genre_similarity.profile_similarities(profile, ids)
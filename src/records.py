@@ -0,0 +1,181 @@
+import base64
+import binascii
+import json
+import math
+import numpy as np
+import pandas as pd
+from fastapi.responses import Response
+
+MAX_PAGE_SIZE = 100 # every ranking holds at most 100 animes
+
+
+def dumps(value):
+    '''
+    Same encoding as FastAPI's JSONResponse.
+    '''
+    return json.dumps(value, ensure_ascii=False, allow_nan=False, separators=(',', ':')).encode('utf-8')
+
+
+def anime_records(anime_df: pd.DataFrame):
+    '''
+    Recommendation payload of every anime in anime_df, in row order.
+    '''
+    columns = zip(
+        anime_df['anime_id'].tolist(),
+        anime_df['name'].tolist(),
+        anime_df['image'].tolist(),
+        anime_df['english_name'].tolist(),
+        anime_df['other_name'].tolist(),
+        anime_df['synopsis'].tolist(),
+        anime_df['genres'].tolist(),
+        anime_df['score'].to_numpy(dtype=np.float64).tolist(),
+    )
+    for id, name, image, english_name, other_name, synopsis, genres, score in columns:
+        yield {
+         'id': int(id),
+         'name': str(name),
+         'image': str(image),
+         'english_name': str(english_name),
+         'other_name': str(other_name),
+         'synopsis': str(synopsis),
+         'genres': str(genres),
+         'score': None if math.isnan(score) else score
+        }
+
+
+class EncodedRecords():
+    """
+      A ranked list of records that are already JSON, serialized by splicing the fragments together.
+
+      --
+
+      fields:
+        field names, in the order of the fragments of every record.
+
+      records:
+        one tuple of b'"field":value' fragments per record.
+    """
+    def __init__(self, fields: list, records: list):
+        self.fields = fields
+        self.records = records
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, items: slice):
+        return EncodedRecords(self.fields, self.records[items])
+
+    def select(self, fields: list):
+        '''
+        Only `fields` of every record, in the stored field order. Raises KeyError for unknown fields.
+        '''
+        unknown = [field for field in fields if field not in self.fields]
+        if(unknown):
+            raise KeyError(', '.join(unknown))
+        keep = [i for i, field in enumerate(self.fields) if field in fields]
+        return EncodedRecords([self.fields[i] for i in keep], [tuple(record[i] for i in keep) for record in self.records])
+
+    def encode(self):
+        return b'[' + b','.join(b'{' + b','.join(record) + b'}' for record in self.records) + b']'
+
+
+class RecordStore():
+    """
+      Response record of every anime in the catalog, encoded to JSON once at load time.
+
+      --
+
+      records:
+        row position in anime_df -> the `"field":value` JSON fragments of that anime, so answering a request
+        is a gather + join instead of building and re-encoding one dict per anime.
+    """
+    def __init__(self, fields: list, records: list):
+        self.fields = fields
+        self.records = records
+
+    @classmethod
+    def from_records(cls, records):
+        fields = None
+        encoded = []
+        for record in records:
+            fields = fields or list(record)
+            encoded.append(tuple(dumps(field) + b':' + dumps(value) for field, value in record.items()))
+        return cls(fields or [], encoded)
+
+    def __len__(self):
+        return len(self.records)
+
+    def take(self, rows):
+        return EncodedRecords(self.fields, [self.records[row] for row in rows])
+
+    def select(self, fields: list, nulls: dict = None):
+        '''
+        Another response shape of the same animes: `fields` in that order, sharing this store's fragments
+        instead of encoding the catalog again. nulls: field -> rows whose value is null in the new shape.
+        '''
+        columns = [self.fields.index(field) for field in fields]
+        records = [tuple(record[i] for i in columns) for record in self.records]
+        for field, rows in (nulls or {}).items():
+            i = fields.index(field)
+            null = dumps(field) + b':null'
+            for row in rows:
+                records[row] = records[row][:i] + (null,) + records[row][i + 1:]
+        return RecordStore(fields, records)
+
+
+def encode_cursor(offset: int):
+    return base64.urlsafe_b64encode(str(offset).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor: str):
+    '''
+    Offset of a cursor from encode_cursor, 0 for None. Raises ValueError for anything else.
+    '''
+    if(cursor is None):
+        return 0
+    try:
+        offset = int(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError):
+        raise ValueError(f'invalid cursor {cursor!r}')
+    if(offset < 0):
+        raise ValueError(f'invalid cursor {cursor!r}')
+    return offset
+
+
+def paginate(result, limit: int = MAX_PAGE_SIZE, cursor: str = None, fields: list = None):
+    '''
+    {'data': page, 'next': cursor of the following page or None} of a ranked EncodedRecords,
+    projected on `fields`. Any other result (i.e. the fuzzy title suggestions) is returned whole as {'data': result}.
+    Raises ValueError for a bad cursor and KeyError for unknown fields.
+    '''
+    if(not isinstance(result, EncodedRecords)):
+        return {'data': result}
+
+    start = decode_cursor(cursor)
+    page = result[start:start + limit]
+    if(fields):
+        page = page.select(fields)
+    return {'data': page, 'next': encode_cursor(start + limit) if start + limit < len(result) else None}
+
+
+def encode(value):
+    '''
+    JSON bytes of value, splicing in EncodedRecords as they are.
+    '''
+    if(isinstance(value, EncodedRecords)):
+        return value.encode()
+    if(isinstance(value, dict)):
+        return b'{' + b','.join(dumps(str(key)) + b':' + encode(item) for key, item in value.items()) + b'}'
+    if(isinstance(value, (list, tuple))):
+        return b'[' + b','.join(encode(item) for item in value) + b']'
+    return dumps(value)
+
+
+class RecordsResponse(Response):
+    """
+      JSON response for content holding EncodedRecords. Return it from the endpoint directly,
+      FastAPI would otherwise run the content through jsonable_encoder first.
+    """
+    media_type = 'application/json'
+
+    def render(self, content):
+        return encode(content)
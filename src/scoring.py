@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+
+SCORE_WEIGHT = .040
+RATING_WEIGHT = 1.2
+GENRE_WEIGHT = 1.0
+
+RECOMMENDATIONS = 100
+
+
+class ScoringEngine():
+    """
+      Ranks candidate animes by a weighted total of score and similarities.
+
+      --
+
+      Keeps an anime_id -> row position index over anime_df, so every step works on NumPy arrays
+      gathered by row instead of filtering anime_df once per candidate.
+
+      total = score * SCORE_WEIGHT + rating similarity * RATING_WEIGHT + genre similarity * GENRE_WEIGHT
+    """
+    def __init__(self, anime_df: pd.DataFrame):
+        self.anime_df = anime_df
+        self.ids = anime_df['anime_id'].to_numpy()
+        self.index = pd.Index(self.ids)
+        self.scores = anime_df['score'].to_numpy(dtype=np.float32)
+
+    def positions(self, ids):
+        '''
+        Row of each anime_id in anime_df, -1 for animes that are not in the catalog.
+        '''
+        return self.index.get_indexer(np.asarray(ids))
+
+    def rank(self, ids, rating_similarity, genre_similarity, n: int = RECOMMENDATIONS):
+        '''
+        Rows of the n best candidates, best first. Candidates missing from the catalog are dropped.
+        '''
+        rows = self.positions(ids)
+        found = rows >= 0
+        rows = rows[found]
+
+        total = (self.scores[rows] * SCORE_WEIGHT
+                 + np.asarray(rating_similarity, dtype=np.float32)[found] * RATING_WEIGHT
+                 + np.asarray(genre_similarity, dtype=np.float32)[found] * GENRE_WEIGHT)
+
+        if(n < len(total)):
+            top = np.argpartition(total, -n)[-n:]
+        else:
+            top = np.arange(len(total))
+        top = top[np.argsort(-total[top], kind='stable')]
+        return rows[top]
@@ -1,5 +1,31 @@
+import os
+import re
+import unicodedata
+import numpy as np
 import pandas as pd
-from thefuzz import fuzz
+from rapidfuzz import fuzz, process
+
+TITLE_COLUMNS = ['name', 'english_name', 'other_name'] # romaji, english, japanese
+PUNCTUATION = re.compile(r'[^\w\s]')
+
+CONTAINS_RESULTS = 5 # per title column
+FUZZ_CUTOFF = 70
+FUZZ_RESULTS = 5
+FUZZ_WORKERS = int(os.getenv('FUZZ_WORKERS', 1)) # threads used by rapidfuzz, -1 for all cores
+
+
+def normalize_title(title: str):
+    '''
+    Casefolds and strips punctuation / repeated whitespace, i.e. 'Steins;Gate ' --> 'steins gate'.
+    '''
+    title = unicodedata.normalize('NFKC', title).casefold()
+    title = PUNCTUATION.sub(' ', title)
+    return ' '.join(title.split())
+
+
+def trigrams(title: str):
+    return {title[i:i + 3] for i in range(len(title) - 2)}
+
 
 class Search():
     """
@@ -9,7 +35,7 @@ class Search():
 
       get_anime_id:
        exact search
-       returns anime_id if exact match.
+       returns anime_id if exact match (after normalizing case, punctuation and whitespace).
 
       get_fuzz_names:
         fuzzy search
@@ -17,29 +43,54 @@ class Search():
          i.e. 'Nruto' --> returns 'Naruto'.. etc.
 
       get_similar_names:
-        contains search
-        returns top 2 highest score names.
+        contains search through a trigram index
+        returns the 5 highest score names of each title column, highest score first.
          i.e. 'Mushoku' --> returns 'Mushoku Tensei: Jobless Reincarnation'
     """
     def __init__(self, anime_df: pd.DataFrame):
         self.anime_df = anime_df
 
-    def get_anime_id(self, name: str, titleCategory: str):
+        # title -> anime_id over every title column, the romaji name taking priority over the english name over the japanese name
+        self.titles = {}
+        self.normalized_titles = {}
+        # deduplicated normalized titles for the fuzzy search, with the title shown to the user for each
+        self.choices = []
+        self.choice_titles = []
+        for column in TITLE_COLUMNS:
+            for title, id in zip(anime_df[column], anime_df['anime_id']):
+                if(not isinstance(title, str)):
+                    continue
+                self.titles.setdefault(title, int(id))
+                normalized = normalize_title(title)
+                if(normalized and normalized not in self.normalized_titles):
+                    self.normalized_titles[normalized] = int(id)
+                    self.choices.append(normalized)
+                    self.choice_titles.append(title)
+
+        # every (title column, anime) title for the contains search, highest score first,
+        # so a sorted list of entry numbers is also in score order
+        by_score = anime_df.sort_values(by=['score'], ascending=False, kind='stable')
+        self.entries = [] # (normalized title, title, anime_id, title column, score)
+        for column, title_column in enumerate(TITLE_COLUMNS):
+            for title, id, score in zip(by_score[title_column], by_score['anime_id'], by_score['score']):
+                if(isinstance(title, str)):
+                    self.entries.append((normalize_title(title), title, int(id), column, float(score)))
+        self.entries.sort(key=lambda entry: -entry[4]) # stable, keeps the column order between equal scores
+
+        postings = {}
+        for i, entry in enumerate(self.entries):
+            for gram in trigrams(entry[0]):
+                postings.setdefault(gram, []).append(i)
+        self.trigram_postings = {gram: np.array(entries, dtype=np.int32) for gram, entries in postings.items()}
+
+    def get_anime_id(self, name: str):
         """
-        Queries input to (1) romaji name, (2) english name, (3) japanese name.
+        Looks the input up in the (1) romaji name, (2) english name, (3) japanese name index.
         Returns anime_id if exact match, else -1.
         """
-    
-        try:
-            id = self.anime_df[self.anime_df[titleCategory] == name].anime_id.iloc[0]
-            return id
-        except IndexError: # no results found
-            if(titleCategory == 'name'):
-                return self.get_anime_id(name, 'english_name')
-            elif(titleCategory == 'english_name'):
-                return self.get_anime_id(name, 'other_name')
-            else:
-                return -1
+        if(name in self.titles):
+            return self.titles[name]
+        return self.normalized_titles.get(normalize_title(name), -1)
     
     def create_dict(self, name, similarity):
         d = {'name': name, 'similarity': similarity}
@@ -47,57 +98,45 @@ class Search():
     
     
     def get_fuzz_names(self, name):
-        most_similar: list = [self.create_dict('', 0), self.create_dict('', 0), self.create_dict('', 0), self.create_dict('', 0), self.create_dict('', 0)]
-        self.anime_df['name'].apply(lambda x: self.do_fuzz(x, name, most_similar))
-        self.anime_df['english_name'].apply(lambda x: self.do_fuzz(x, name, most_similar))
-        self.anime_df['other_name'].apply(lambda x: self.do_fuzz(x, name, most_similar))
-        return list(filter(lambda x: x['similarity'] >= 70, most_similar)) ## filter
-    
-    def do_fuzz(self, row, name, most_similar: list):
-        sim = fuzz.ratio(row, name)
-        for i in range(0, 5):
-            if(most_similar[i]['similarity'] < sim and self.create_dict(row, sim) not in most_similar):
-                most_similar.insert(i, self.create_dict(row, sim))
-                most_similar.pop()
-                break
-
-    def get_similar_names(self, name, type):
-        dict = {} # doing dict to ensure only unique values are added by comparing keys
-        a = self.anime_df[self.anime_df[type].fillna('').str.lower().str.contains(name.lower())]
-  
-
-        if(a is not None):
-            a = a.sort_values(by=['score'], ascending=False).head(5)
-            for i in range(0, len(a)):
-                index = 1
-                match(type):
-                    case 'english_name':
-                        index = 2
-                    case 'other_name':
-                        index = 3
-                if(a.values[i][0] not in dict):
-                    dict[a.values[i][0]] = (self.create_dict(a.values[i][index], a.values[i][4]))
-        
-        if(type == 'name'):
-            dict.update(self.get_similar_names(name, 'english_name'))
-        elif(type == 'english_name'):
-            dict.update(self.get_similar_names(name, 'other_name'))
-        return dict
-    
-    
-    def sort_scores(self, d):
-     arr = list(d.items())
-     n = len(arr)
-
-     if(n <= 1):
-        return list(map(lambda x: x[1], arr))
-     for i in range(1, n):
-        key = arr[i]
-        j = i - 1
-
-        while(j >= 0 and key[1]['similarity'] > arr[j][1]['similarity']):
-            arr[j + 1] = arr[j]
-            j -= 1
-        arr[j + 1] = key
-     arr = list(map(lambda x: x[1], arr))
-     return arr
\ No newline at end of file
+        '''
+        Top 5 titles with a fuzz.ratio of at least 70, scored against every title in one batched rapidfuzz call.
+        '''
+        scores = process.cdist([normalize_title(name)], self.choices, scorer=fuzz.ratio, score_cutoff=FUZZ_CUTOFF, dtype=np.uint8, workers=FUZZ_WORKERS)[0]
+
+        top = np.flatnonzero(scores >= FUZZ_CUTOFF)
+        top = top[np.argsort(-scores[top].astype(np.int16), kind='stable')][:FUZZ_RESULTS] # highest first, ties in title order
+
+        return [self.create_dict(self.choice_titles[i], int(scores[i])) for i in top]
+
+    def get_similar_names(self, name):
+        '''
+        Titles containing the input, ranked by score. Only the entries holding every trigram of the
+        input are checked, in score order, stopping once every title column has its 5 results.
+        '''
+        query = normalize_title(name)
+        grams = trigrams(query)
+        if(grams):
+            lists = sorted((self.trigram_postings.get(gram) for gram in grams), key=lambda l: -1 if l is None else len(l))
+            if(lists[0] is None): # a trigram no title has
+                return []
+            candidates = lists[0]
+            for l in lists[1:]:
+                candidates = np.intersect1d(candidates, l, assume_unique=True)
+        else: # too short for a trigram, every title is a candidate
+            candidates = range(len(self.entries))
+
+        matches = [[] for _ in TITLE_COLUMNS]
+        found = 0
+        for i in candidates:
+            normalized, title, id, column, score = self.entries[i]
+            if(len(matches[column]) < CONTAINS_RESULTS and query in normalized):
+                matches[column].append((id, title, score))
+                found += 1
+                if(found == CONTAINS_RESULTS * len(TITLE_COLUMNS)):
+                    break
+
+        d = {} # doing dict to ensure only unique animes are added by comparing keys
+        for column in matches:
+            for id, title, score in column:
+                d[id] = self.create_dict(title, score)
+        return sorted(d.values(), key=lambda x: -x['similarity'])
@@ -0,0 +1,232 @@
+import argparse
+import os
+import numpy as np
+import pandas as pd
+from src.artifacts import build_lock, replace_file, save_array
+from src.log import get_logger, fields
+
+log = get_logger(__name__)
+
+MODEL_DIR = os.getenv('MODEL_DIR', 'model')
+NEIGHBORS_K = int(os.getenv('NEIGHBORS_K', 300))
+
+MATRIX_FILE = 'similarity.npy'
+IDS_FILE = 'similarity_ids.npy'
+NEIGHBOR_IDS_FILE = 'neighbors_ids.npy'
+NEIGHBOR_POSITIONS_FILE = 'neighbors_pos.npy'
+NEIGHBOR_SIMILARITIES_FILE = 'neighbors_sim.npy'
+
+
+class SimilarityStore():
+    """
+      Item-item similarity matrix kept on disk as a raw .npy matrix + an int32 anime_id index.
+
+      --
+
+      matrix:
+        (N, N) float16/float32, opened with mmap so only the rows that are read get paged in.
+        Row i holds the similarity of every anime in `ids` to ids[i].
+
+      ids:
+        (N,) int32 anime_ids, the order of both the rows and the columns of `matrix`.
+    """
+    def __init__(self, matrix: np.ndarray, ids: np.ndarray):
+        self.matrix = matrix
+        self.ids = ids
+        self.positions = {int(id): i for i, id in enumerate(ids)}
+
+    @classmethod
+    def load(cls, directory: str = MODEL_DIR):
+        matrix = np.load(os.path.join(directory, MATRIX_FILE), mmap_mode='r')
+        ids = np.load(os.path.join(directory, IDS_FILE))
+        return cls(matrix, ids)
+
+    @staticmethod
+    def exists(directory: str = MODEL_DIR):
+        return os.path.exists(os.path.join(directory, MATRIX_FILE)) and os.path.exists(os.path.join(directory, IDS_FILE))
+
+    def __contains__(self, id):
+        return int(id) in self.positions
+
+    def __len__(self):
+        return len(self.ids)
+
+    def position(self, id):
+        '''
+        Row of `id` in the matrix. Raises KeyError if the anime has no similarities.
+        '''
+        return self.positions[int(id)]
+
+    def column(self, id):
+        '''
+        Similarities of every anime to `id`, aligned with self.ids.
+        '''
+        return self.matrix[self.position(id)]
+
+
+class NeighborIndex():
+    """
+      Top-K most similar animes of every anime, stored as contiguous (N, K) arrays.
+
+      --
+
+      ids:
+        (N,) int32 anime_ids, row i of the tables belongs to ids[i].
+
+      positions:
+        (N, K) int32 rows (into ids) of the neighbors, most similar first. Itself is never included.
+        Rows with fewer than K neighbors are padded with -1.
+
+      similarities:
+        (N, K) similarities matching `positions`.
+    """
+    def __init__(self, ids: np.ndarray, positions: np.ndarray, similarities: np.ndarray):
+        self.ids = ids
+        self.positions = positions
+        self.similarities = similarities
+        self.rows = {int(id): i for i, id in enumerate(ids)}
+
+    @classmethod
+    def load(cls, directory: str = MODEL_DIR):
+        ids = np.load(os.path.join(directory, NEIGHBOR_IDS_FILE))
+        positions = np.load(os.path.join(directory, NEIGHBOR_POSITIONS_FILE), mmap_mode='r')
+        similarities = np.load(os.path.join(directory, NEIGHBOR_SIMILARITIES_FILE), mmap_mode='r')
+        return cls(ids, positions, similarities)
+
+    @staticmethod
+    def exists(directory: str = MODEL_DIR):
+        return all(os.path.exists(os.path.join(directory, f)) for f in [NEIGHBOR_IDS_FILE, NEIGHBOR_POSITIONS_FILE, NEIGHBOR_SIMILARITIES_FILE])
+
+    def save(self, directory: str = MODEL_DIR):
+        os.makedirs(directory, exist_ok=True)
+        save_array(os.path.join(directory, NEIGHBOR_IDS_FILE), self.ids)
+        save_array(os.path.join(directory, NEIGHBOR_SIMILARITIES_FILE), self.similarities)
+        save_array(os.path.join(directory, NEIGHBOR_POSITIONS_FILE), self.positions) # last, its mtime marks the table as built
+
+    def __contains__(self, id):
+        return int(id) in self.rows
+
+    @property
+    def k(self):
+        return self.positions.shape[1]
+
+    def neighbors(self, id, k: int = None):
+        '''
+        anime_ids and similarities of the (up to) k most similar animes to `id`, most similar first.
+        Raises KeyError if the anime has no similarities.
+        '''
+        row = self.rows[int(id)]
+        positions = self.positions[row, :k]
+        similarities = self.similarities[row, :k]
+        valid = positions >= 0
+        return self.ids[positions[valid]], np.asarray(similarities[valid], dtype=np.float32)
+
+
+def build_neighbors(store: SimilarityStore, k: int = NEIGHBORS_K, block: int = 1024):
+    '''
+    Top-k table from the dense store, a block of rows at a time so only block x N floats are in memory.
+    '''
+    n = len(store)
+    k = min(k, n - 1)
+    positions = np.empty((n, k), dtype=np.int32)
+    similarities = np.empty((n, k), dtype=store.matrix.dtype)
+
+    for start in range(0, n, block):
+        stop = min(start + block, n)
+        rows = np.array(store.matrix[start:stop], dtype=np.float32)
+        rows[np.isnan(rows)] = -np.inf # animes without co-ratings (NaN) sort last
+        rows[np.arange(stop - start), np.arange(start, stop)] = -np.inf # never its own neighbor
+
+        top = np.argpartition(rows, -k, axis=1)[:, -k:]
+        top_sims = np.take_along_axis(rows, top, axis=1)
+        order = np.argsort(-top_sims, axis=1, kind='stable')
+
+        top = np.take_along_axis(top, order, axis=1)
+        top_sims = np.take_along_axis(top_sims, order, axis=1)
+        missing = ~np.isfinite(top_sims) # fewer than k real neighbors, pad like short rows
+        top[missing] = -1
+        top_sims[missing] = 0
+
+        positions[start:stop] = top
+        similarities[start:stop] = top_sims
+
+    return NeighborIndex(store.ids, positions, similarities)
+
+
+def load_neighbors(k: int = NEIGHBORS_K, directory: str = MODEL_DIR, csv_path: str = 'Data.csv'):
+    '''
+    Opens the top-k table. A table without a dense store next to it (i.e. written by src.build_similarity) is used as is,
+    otherwise it is (re)built from the dense store / Data.csv if it is missing, too small or older than the store.
+    Only one worker process builds it, the others wait for it and mmap the same files.
+    '''
+    def current():
+        if(not NeighborIndex.exists(directory)):
+            return None
+        neighbors = NeighborIndex.load(directory)
+        if(not SimilarityStore.exists(directory)):
+            return neighbors
+        built = os.path.getmtime(os.path.join(directory, NEIGHBOR_POSITIONS_FILE))
+        if(built >= os.path.getmtime(os.path.join(directory, MATRIX_FILE)) and neighbors.k >= min(k, len(neighbors.ids) - 1)):
+            return neighbors
+        return None
+
+    with build_lock(directory, shared=True):
+        neighbors = current()
+    if(neighbors is not None):
+        return neighbors
+
+    with build_lock(directory):
+        neighbors = current() # another worker may have built it while we waited
+        if(neighbors is None):
+            log.info('building the neighbor table', extra=fields(directory=directory, k=k))
+            store = SimilarityStore.load(directory) if SimilarityStore.exists(directory) else convert_csv(csv_path, directory)
+            build_neighbors(store, k).save(directory)
+            neighbors = NeighborIndex.load(directory)
+    return neighbors
+
+
+def remove_store(directory: str = MODEL_DIR):
+    '''
+    Drops the dense store, so a table written by src.build_similarity is never judged stale against
+    (and rebuilt from) an older Data.csv conversion. Workers that have it mmapped keep the old inode.
+    '''
+    for name in [MATRIX_FILE, IDS_FILE]:
+        path = os.path.join(directory, name)
+        if(os.path.exists(path)):
+            os.remove(path)
+
+
+def convert_csv(csv_path: str = 'Data.csv', directory: str = MODEL_DIR, dtype: str = 'float16'):
+    '''
+    One-time conversion of the dense Data.csv (anime_id index, anime_id columns) into the binary store.
+    '''
+    df = pd.read_csv(csv_path, index_col=0, dtype=np.float32)
+    ids = df.columns.astype('int32').to_numpy()
+    df.index = df.index.astype('int32')
+    df = df.loc[ids] # rows in the same order as the columns
+
+    os.makedirs(directory, exist_ok=True)
+    save_array(os.path.join(directory, IDS_FILE), ids)
+    with replace_file(os.path.join(directory, MATRIX_FILE)) as tmp:
+        # stored transposed so that reading the similarities to one anime is a single contiguous row
+        matrix = np.lib.format.open_memmap(tmp, mode='w+', dtype=dtype, shape=(len(ids), len(ids)))
+        matrix[:] = df.to_numpy().T
+        matrix.flush()
+        del matrix
+
+    return SimilarityStore.load(directory)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert Data.csv into the binary item-similarity store and its top-k neighbor table.')
+    parser.add_argument('csv', nargs='?', default='Data.csv')
+    parser.add_argument('--out', default=MODEL_DIR)
+    parser.add_argument('--dtype', default='float16', choices=['float16', 'float32'])
+    parser.add_argument('--k', type=int, default=NEIGHBORS_K, help='neighbors kept per anime in the top-k table')
+    args = parser.parse_args()
+
+    with build_lock(args.out):
+        store = convert_csv(args.csv, args.out, args.dtype)
+        print(f'wrote {len(store)} x {len(store)} {args.dtype} similarities to {args.out}')
+        build_neighbors(store, args.k).save(args.out)
+    print(f'wrote top {min(args.k, len(store) - 1)} neighbors per anime to {args.out}')
@@ -0,0 +1,170 @@
+import argparse
+import json
+import os
+import time
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.feature_extraction.text import TfidfVectorizer
+from src.artifacts import build_lock, replace_file, save_array
+from src.similarity import MODEL_DIR
+from src.log import get_logger, fields
+
+log = get_logger(__name__)
+
+SNAPSHOT_VERSION = 1 # bump when the preprocessing changes, older snapshots are then rebuilt
+SNAPSHOT_DIR = os.getenv('SNAPSHOT_DIR', os.path.join(MODEL_DIR, 'catalog'))
+SNAPSHOT_MAX_AGE = float(os.getenv('SNAPSHOT_MAX_AGE', 24 * 3600)) # seconds, 0 to never rebuild a valid snapshot
+
+MANIFEST_FILE = 'manifest.json'
+NUMERIC_COLUMNS = {'anime_id': 'int32', 'score': 'float16'}
+
+
+class Catalog():
+    """
+      The preprocessed catalog the service runs on.
+
+      --
+
+      anime_df:
+        every anime, genres cleaned up for the TF-IDF tokenizer.
+
+      tfidf:
+        TfidfVectorizer fitted on the genres.
+
+      tfidf_matrix:
+        (N, vocabulary) L2-normalised sparse genre rows, aligned with anime_df.
+    """
+    def __init__(self, anime_df: pd.DataFrame, tfidf: TfidfVectorizer, tfidf_matrix: sparse.csr_matrix):
+        self.anime_df = anime_df
+        self.tfidf = tfidf
+        self.tfidf_matrix = tfidf_matrix
+
+
+def build_catalog(engine):
+    '''
+    Reads the animes table and preprocesses it (the slow path).
+    '''
+    anime_df = pd.read_sql("select * from animes", con=engine)
+
+    # Scores only go from [-1, 10]
+    anime_df['score'] = anime_df['score'].astype('float16')
+    # Anime_id goes from [1, 55647]
+    anime_df['anime_id'] = anime_df['anime_id'].astype('int32')
+
+    anime_df['genres'] = anime_df['genres'].str.replace(',', '')
+    anime_df['genres'] = anime_df['genres'].str.replace('-','_')
+    anime_df['genres'] = anime_df['genres'].str.replace('(','')
+    anime_df['genres'] = anime_df['genres'].str.replace(')', '')
+
+    tfidf = TfidfVectorizer()
+    tfidf_matrix = tfidf.fit_transform(anime_df['genres'])
+    return Catalog(anime_df, tfidf, sparse.csr_matrix(tfidf_matrix, dtype=np.float32))
+
+
+def save_catalog(catalog: Catalog, directory: str = SNAPSHOT_DIR):
+    '''
+    Numeric columns and the TF-IDF arrays as .npy, the text columns pickled, the vocabulary as json.
+    The manifest is written last, a snapshot without one is incomplete. Every file is replaced atomically,
+    so workers still running on the previous snapshot keep their mmaps.
+    '''
+    os.makedirs(directory, exist_ok=True)
+    manifest = os.path.join(directory, MANIFEST_FILE)
+    if(os.path.exists(manifest)):
+        os.remove(manifest)
+
+    df = catalog.anime_df
+    for column in NUMERIC_COLUMNS:
+        save_array(os.path.join(directory, f'{column}.npy'), df[column].to_numpy())
+    with replace_file(os.path.join(directory, 'text_columns.pkl')) as tmp:
+        df.drop(columns=list(NUMERIC_COLUMNS)).to_pickle(tmp)
+
+    with replace_file(os.path.join(directory, 'tfidf_vocabulary.json')) as tmp:
+        with open(tmp, 'w') as f:
+            json.dump({term: int(column) for term, column in catalog.tfidf.vocabulary_.items()}, f)
+    save_array(os.path.join(directory, 'tfidf_idf.npy'), catalog.tfidf.idf_)
+
+    matrix = catalog.tfidf_matrix
+    save_array(os.path.join(directory, 'tfidf_data.npy'), matrix.data)
+    save_array(os.path.join(directory, 'tfidf_indices.npy'), matrix.indices)
+    save_array(os.path.join(directory, 'tfidf_indptr.npy'), matrix.indptr)
+
+    with replace_file(manifest) as tmp, open(tmp, 'w') as f:
+        json.dump({
+            'version': SNAPSHOT_VERSION,
+            'created': time.time(),
+            'rows': len(df),
+            'columns': list(df.columns),
+            'tfidf_shape': list(matrix.shape),
+        }, f)
+
+
+def read_manifest(directory: str = SNAPSHOT_DIR):
+    try:
+        with open(os.path.join(directory, MANIFEST_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_fresh(manifest: dict, max_age: float = SNAPSHOT_MAX_AGE):
+    if(manifest is None or manifest.get('version') != SNAPSHOT_VERSION):
+        return False
+    return max_age <= 0 or time.time() - manifest['created'] < max_age
+
+
+def load_snapshot(directory: str = SNAPSHOT_DIR, manifest: dict = None):
+    '''
+    The TF-IDF arrays are opened with mmap, so every worker process shares the same pages.
+    '''
+    manifest = manifest or read_manifest(directory)
+
+    df = pd.read_pickle(os.path.join(directory, 'text_columns.pkl'))
+    for column, dtype in NUMERIC_COLUMNS.items():
+        df[column] = np.load(os.path.join(directory, f'{column}.npy')).astype(dtype, copy=False)
+    df = df[manifest['columns']]
+
+    tfidf = TfidfVectorizer()
+    with open(os.path.join(directory, 'tfidf_vocabulary.json')) as f:
+        tfidf.vocabulary_ = json.load(f)
+    tfidf.idf_ = np.load(os.path.join(directory, 'tfidf_idf.npy'))
+
+    tfidf_matrix = sparse.csr_matrix((
+        np.load(os.path.join(directory, 'tfidf_data.npy'), mmap_mode='r'),
+        np.load(os.path.join(directory, 'tfidf_indices.npy'), mmap_mode='r'),
+        np.load(os.path.join(directory, 'tfidf_indptr.npy'), mmap_mode='r'),
+    ), shape=tuple(manifest['tfidf_shape']), copy=False)
+
+    return Catalog(df, tfidf, tfidf_matrix)
+
+
+def load_catalog(engine, directory: str = SNAPSHOT_DIR):
+    '''
+    The catalog from the snapshot, rebuilt from SQL (and saved) only when the snapshot is missing or stale.
+    Only one worker process rebuilds it, the others wait for it and load the same files.
+    '''
+    with build_lock(directory, shared=True):
+        manifest = read_manifest(directory)
+        if(is_fresh(manifest)):
+            return load_snapshot(directory, manifest)
+
+    with build_lock(directory):
+        manifest = read_manifest(directory)
+        if(not is_fresh(manifest)): # another worker may have rebuilt it while we waited
+            log.info('rebuilding the catalog snapshot', extra=fields(directory=directory))
+            save_catalog(build_catalog(engine), directory)
+            manifest = read_manifest(directory)
+        return load_snapshot(directory, manifest)
+
+
+if __name__ == '__main__':
+    from src.db import get_engine
+
+    parser = argparse.ArgumentParser(description='Rebuild the catalog snapshot from the animes table.')
+    parser.add_argument('--out', default=SNAPSHOT_DIR)
+    args = parser.parse_args()
+
+    catalog = build_catalog(get_engine())
+    with build_lock(args.out):
+        save_catalog(catalog, args.out)
+    print(f'wrote snapshot of {len(catalog.anime_df)} animes to {args.out}')
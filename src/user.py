@@ -1,325 +1,174 @@
-import time
-from typing import Tuple, List
+from typing import List
 import numpy as np
-import pandas as pd
-import psycopg2
-import requests
-import os
-from dotenv import load_dotenv, dotenv_values
+from scipy import sparse
+from src.jikan import get_resolver
+from src.franchise import FranchiseGraph
+from src.log import get_logger, fields
+from src.metrics import timed
 
-def getData(userlist, allAnimes):
-        if(len(userlist) == 0): # no anime on their account.
-            return -1
-        
-        animes: List[Tuple[int, str, int, str]] = []
-        completed_animes: List[int] = [] ## using this for users that do not rate anime --> I only want to use anime they have completed.
-        scores: List[int] = []
+log = get_logger(__name__)
+
+def parseList(allAnimes):
+    '''
+    MAL list entries -> (ids, list scores (0 when not rated), completed flags, genre names of every entry).
+    '''
+    nodes = [anime['node'] for anime in allAnimes]
+    statuses = [anime['list_status'] for anime in allAnimes]
+    ids = np.array([node['id'] for node in nodes], dtype=np.int64)
+    scores = np.array([status['score'] for status in statuses], dtype=np.float64)
+    completed = np.array([status['status'] == 'completed' for status in statuses], dtype=bool)
+    genres = [[genre['name'] for genre in node.get('genres', ())] for node in nodes]
+    return ids, scores, completed, genres
+
+def genreTerm(genre: str):
+    '''
+    MAL genre name -> its term in the TF-IDF vocabulary, cleaned up the same way as the catalog's genres ('Slice of Life' -> 'slice_of_life').
+    '''
+    return genre.replace(' ', '_').replace('-', '_').replace('(', '').replace(')', '').replace(',', '').lower()
+
+def getProfile(genres, tfidf):
+    '''
+    Mean TF-IDF vector of the genres of every anime on the list, as a (1, vocabulary) array.
+    Same as tfidf.transform(...).mean(axis=0), built as one sparse matrix straight from the vocabulary.
+    '''
+    if(len(genres) == 0):
+        return np.zeros((1, len(tfidf.vocabulary_)))
 
-        for i in range(0, len(allAnimes)):
-            ### getting name + score if rated
-            name: str = allAnimes[i]['node']['title']
-            id: int = allAnimes[i]['node']['id']
-            score = -1
-            if(allAnimes[i]['list_status']['score'] != 0):
-                score = allAnimes[i]['list_status']['score']
-                scores.append(score)
-            
-            ### counting genres
-            genre: str = ''
-            try:
-              for j in range(0, len(allAnimes[i]['node']['genres'])):
-                genre += allAnimes[i]['node']['genres'][j]['name'] + ','
+    names = [genre for entry in genres for genre in entry]
+    vocabulary = {genre: tfidf.vocabulary_.get(genreTerm(genre), -1) for genre in set(names)} # a list has only a few dozen distinct genres
+    columns = np.array([vocabulary[genre] for genre in names], dtype=np.int64)
+    rows = np.repeat(np.arange(len(genres)), [len(entry) for entry in genres])
+    known = columns >= 0 # genres the catalog does not have are dropped, like transform does
 
-            except KeyError:
-                print(f'No genres were found for {name}')
+    counts = sparse.csr_matrix((np.ones(np.count_nonzero(known)), (rows[known], columns[known])), shape=(len(genres), len(tfidf.vocabulary_)))
+    weighted = sparse.csr_matrix(counts.multiply(tfidf.idf_))
+    norms = np.sqrt(np.asarray(weighted.multiply(weighted).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    weighted = sparse.diags(1 / norms) @ weighted
 
-            # cleaning up for tfidf algorithm
+    return np.asarray(weighted.sum(axis=0)) / len(genres)
 
-            genre = genre.replace(' ', '_')
-            genre = genre.replace(',',' ')
+def getData(userlist, allAnimes, franchise: FranchiseGraph, tfidf, neighbors=None):
+        if(len(userlist) == 0): # no anime on their account.
+            return -1
 
-            animes.append((id, name, score, genre))
-            if(allAnimes[i]['list_status']['status'] == 'completed'):
-                completed_animes.append(id)
+        with timed('profile_build'):
+            ids, scores, completed, genres = parseList(allAnimes)
+            profile = getProfile(genres, tfidf)
 
-        genres = getGenres(animes)
+        rated = scores != 0 ## the list comes sorted by list score, so rated animes come first
+        rated_ids = ids[rated]
+        rated_scores = scores[rated]
 
-        topAnimes = []
+        if(len(rated_scores) != 0 and rated_scores.std() > 0):
+            z_scores = (rated_scores - rated_scores.mean()) / rated_scores.std()
+            mean: float = z_scores[z_scores > 0].mean()
+            topAnimes, positions = getTopAnimes(rated_ids, z_scores, mean, franchise, neighbors)
 
-        if(len(scores) != 0 and np.mean(scores) != scores[0]):
-            z_scores: List[Tuple[int, str, float]] = []
-            mean: float = np.mean(scores)
-            std: float = np.std(scores) 
-            positive_z_scores = np.array([], dtype=float) # 
-            for i in range(0, len(scores)):
-                z = (scores[i] - mean) / std
-                if(z > 0):
-                    positive_z_scores = np.append(positive_z_scores, z)
-                id = animes[i][0]
-                name = animes[i][1]
-                z_scores.append((id, name, z))
-            mean = positive_z_scores.mean()
-            topAnimes = getTopAnimes(z_scores, mean)
+            weights = getWeights(z_scores, mean)[positions] # weight of the rated anime each top anime was resolved from
+            return {'topAnimes': topAnimes, 'ids': ids, 'profile': profile, 'weights': weights}
 
-            weights = getWeights(z_scores, mean)
-            weights = weights[0:len(topAnimes)]
-            print(f'top: {len(topAnimes)}')
-            return {'topAnimes': topAnimes, 'genres': genres, 'weights': weights }
-        
         else: ## case where user does not rate any animes or they rate everything the same --> using first 10 animes (or however much they have if below 10)
-            for i in range(0, len(completed_animes)):
-                topAnimes.append(completed_animes[i])
-            topAnimes = getAnimes(topAnimes)
+            topAnimes = getAnimes(ids[completed].tolist(), franchise, neighbors)
             if len(topAnimes) == 0:
                 return -1
 
-            return {'topAnimes': topAnimes, 'genres': genres }
+            return {'topAnimes': topAnimes, 'ids': ids, 'profile': profile}
                 
 def getWeights(z_scores, mean):
     '''
     returns the weight of each anime from topAnimes using its z_score minus the mean of all the positive z_scores.
     '''
-    scores = [entry[2] for entry in z_scores]
-    weights: list[float] = [score - mean for score in scores]
-
-    return np.array(weights) 
-        
-        
-def getGenres(animes):
-    df = pd.DataFrame(animes, columns=['id', 'name', 'score', 'genres'])
-    df = df.drop(columns=['name', 'score'], axis=1)
-
-    return df
-
-def getTopAnimes(z_scores, mean):
-    config = os.getenv('PSYCOPG2_CRED')
-    conn = psycopg2.connect(config)
-    cur = conn.cursor()
-    
+    return z_scores - mean
 
-    topAnimes: List[str] = []
-
-        # keep adding until
-        # 1. there have been 10 animes added
-        
-        # before 10 animes, stop if
-        # z_score is below cutoff
-    i = 0
-    while((len(topAnimes) < 10) and (z_scores[i][2] > mean )): 
-        sql = 'SELECT name FROM animes WHERE anime_id = %s'
-        id = z_scores[i][0]
-        print(f'trying {id}')
-        cur.execute(sql, [id])
-        query = cur.fetchone()
+def getTopAnimes(ids, z_scores, mean, franchise: FranchiseGraph, neighbors=None):
+    '''
+    Up to 10 animes from the catalog for the rated animes whose z_score is above the cutoff, best first.
+    Also returns the index in z_scores each of them came from.
+    '''
+    below = np.flatnonzero(z_scores <= mean)
+    candidates = ids[:below[0] if len(below) else len(ids)]
 
-        if(query is not None): # has exact match in the anime table.
-            print(f'exact match:  {query[0]}')
-            addAnimes(topAnimes, id)
-        else:
-            sql = "WITH get_relations as (SELECT source_id, relation FROM relations, unnest(string_to_array(relations.relations, ', ', '')) as relation GROUP BY source_id, relation) SELECT anime_id FROM get_relations JOIN animes ON (CAST(get_relations.relation AS integer) = animes.anime_id) WHERE source_id = (SELECT source_id FROM get_relations WHERE CAST(relation AS integer) = %s)"
-              # Checking the relations table to find the one that is in the actual anime table
-            cur.execute(sql, [id])
-            query = cur.fetchone()
-            if(query is not None):
-                print(f'already in relations table: {query[0]}')
-                addAnimes(topAnimes, query[0])
-            else:
-                # Check relations to find the one that exists in the database.
-                    # Find source material --> its adaptations = all relations of the anime.
-                anime_id = updateRelations(id, cur, conn)
-                if(anime_id is not None):
-                    print(f'added, now in relations table: {anime_id}')
-                    addAnimes(topAnimes, anime_id)
-        i += 1
-    return topAnimes
+    return resolveAnimes(candidates.tolist(), franchise, neighbors)
 
-def getAnimes(animes):
+def getAnimes(animes, franchise: FranchiseGraph, neighbors=None):
     '''
     If no animes were rated. Does not consider z_scores.
     '''
-    config = os.getenv('PSYCOPG2_CRED')
-    conn = psycopg2.connect(config)
-    cur = conn.cursor()
-
-    topAnimes: List[str] = []
-    i = 0
-    while(len(topAnimes) < 10 and i < len(animes)):
-        sql = 'SELECT name FROM animes WHERE anime_id = %s'
-        id = animes[i]
-        print(f'trying {id}')
-        cur.execute(sql, [id])
-        query = cur.fetchone()
-
-        if(query is not None):
-            print(f'exact match:  {query}')
-            addAnimes(topAnimes, id)
-        else:
-            sql = "WITH get_relations as (SELECT source_id, relation FROM relations, unnest(string_to_array(relations.relations, ', ', '')) as relation GROUP BY source_id, relation) SELECT anime_id FROM get_relations JOIN animes ON (CAST(get_relations.relation AS integer) = animes.anime_id) WHERE source_id = (SELECT source_id FROM get_relations WHERE CAST(relation AS integer) = %s)"
-              # Checking the relations table to see if already exists
-            cur.execute(sql, [id])
-            query = cur.fetchone()
-            if(query is not None):
-                print(f'already in relations table: {query[0]}')
-                addAnimes(topAnimes, query[0])
-            else:
-                # Check relations to find the one that exists in the database.
-                    # Find source material --> its adaptations = all relations of the anime.
-                anime_id = updateRelations(id, cur, conn)
-                if(anime_id is not None):
-                    print(f'added, now in relations: {anime_id}')
-                    addAnimes(topAnimes, anime_id)
-        i += 1
+    topAnimes, positions = resolveAnimes(animes, franchise, neighbors)
     return topAnimes
-    
-def addAnimes(top, id):
-    if(id not in top):
-        top.append(id)
 
-def updateRelations(id, cur, conn):
-    check = "WITH get_relations as (SELECT source_id, relation FROM relations, unnest(string_to_array(relations.relations, ', ', '')) as relation GROUP BY source_id, relation) SELECT * FROM get_relations WHERE CAST(relation AS integer) = %s"
-    sql = 'SELECT name FROM animes WHERE anime_id = %s'
+def resolveAnimes(ids, franchise: FranchiseGraph, neighbors=None, limit: int = 10):
+    '''
+    Resolves candidates (best first) to animes in the catalog, keeping their order, until `limit` distinct animes are found.
+    Returns the anime_ids and the index of the candidate each one was resolved from.
+    With `neighbors` (the NeighborIndex), animes that are not in it are skipped so the next candidate takes their place.
+
+    Candidates in the catalog or the relations graph are resolved in memory. The others are looked up on Jikan
+    in one concurrent batch per round, and only as many as could still make it into the result.
+    '''
+    with timed('relations_resolution'):
+        return lookUpAnimes(ids, franchise, neighbors, limit)
+
+def lookUpAnimes(ids, franchise: FranchiseGraph, neighbors, limit: int):
+    looked_up = {} # candidate -> anime_id found through Jikan (or None)
+    while True:
+        topAnimes: List[int] = []
+        positions: List[int] = []
+        pending: List[int] = []
+        for i, id in enumerate(ids):
+            if(len(topAnimes) + len(pending) >= limit):
+                break
+            anime_id = id if franchise.in_catalog(id) else franchise.representative(id)
+            if(anime_id is None):
+                if(id not in looked_up):
+                    pending.append(id)
+                    continue
+                anime_id = looked_up[id]
+            if(anime_id is not None and anime_id not in topAnimes and (neighbors is None or anime_id in neighbors)):
+                topAnimes.append(anime_id)
+                positions.append(i)
+
+        if(len(pending) == 0):
+            return topAnimes, positions
+
+        pending = list(dict.fromkeys(pending))
+        log.info('looking up relations on Jikan', extra=fields(ids=pending))
+        for id, anime_id in zip(pending, updateRelations(pending, franchise)):
+            looked_up[id] = anime_id
+
+def updateRelations(ids, franchise: FranchiseGraph):
+    '''
+    Finds the franchise of each anime through Jikan (concurrently) and returns, for each, its anime that is in the catalog (or None).
+    '''
+    resolver = get_resolver()
+    found = resolver.run(resolver.relations_many(ids))
+    return [addRelations(relations, franchise) if relations is not None else None for relations in found]
 
-    relations = getRelations(id) 
-    
-    matched = False
+def addRelations(relations, franchise: FranchiseGraph):
+    '''
+    Returns the anime of a franchise that is in the catalog (or None).
+    The franchise is added to the graph and saved to the relations table in the background.
+    '''
     anime_id = None
     source_id = None
-    #
     for relation_id in relations['relations']: 
-        exists = False
-        if(not exists):
-             cur.execute(check, [relation_id]) # check to see if a value already exists in the relations table. If so, append and update with new relations.
-             q = cur.fetchone()
-             if(q is not None):
-                exists = True
-                source_id = q[0]
-                print(f'does exist... {source_id}')
+        existing = franchise.source_of(relation_id) # check to see if a value already exists in the relations table. If so, append and update with new relations.
+        if(existing is not None):
+            source_id = existing
+            log.debug('franchise already known', extra=fields(anime_id=relation_id, source_id=source_id))
 
-        cur.execute(sql, [relation_id])
-        query = cur.fetchone()
-        if(query is not None):
-            print(f'found in relations:  {query}')
-            matched = True
+        if(franchise.in_catalog(relation_id)):
+            log.debug('found franchise anime in the catalog', extra=fields(anime_id=relation_id))
             anime_id = relation_id
             break
     
     ## updating database
 
-    if(matched):
-        if(source_id is not None):
-            getExisting = 'SELECT relations FROM relations WHERE source_id = %s'
-            cur.execute(getExisting, [source_id])
-            existing = cur.fetchone()
-            new_relations = existing[0]
-            added = ''
-            for relation_id in relations['relations']:
-                relation_id = str(relation_id)
-                if(relation_id not in existing[0]):
-                    new_relations += ', ' + relation_id
-                    added += relation_id + ' '
-            update_db = 'UPDATE relations SET relations = %s WHERE source_id = %s'
-
-            data = (new_relations, source_id)
-            cur.execute(update_db, (data))
-            conn.commit()
-
-            print(f'Updated {source_id}! Prev: {existing[0]} Added: {added}')
-
-        else:
-            relations_to_db = ', '.join(str(x) for x in relations['relations'])
-            add_to_db = 'INSERT INTO relations (source_id, relations) VALUES (%s, %s)' 
-            data = (relations['source_id'], relations_to_db)
-            cur.execute(add_to_db, (data)) 
-            conn.commit()
+    if(anime_id is not None):
+        if(source_id is None):
+            source_id = relations['source_id']
+        added = franchise.add(source_id, relations['relations'])
+        log.info('updated franchise', extra=fields(source_id=source_id, added=added))
     
     return anime_id
-
-    
-
-def getRelations(id):
-    '''
-    Returns the source material id and the ids of animes that are related.
-    '''
-    source_id = getSource(id)
-    if(source_id == -1): # anime original / no source found
-        allRelations = []
-        getRelation(id, allRelations)
-        return {'source_id': -allRelations[0], 'relations': allRelations}
-
-    url = 'https://api.jikan.moe/v4/manga/{id}/relations'.format(id=source_id)
-    time.sleep(0.5)
-    data = requests.get(url).json()['data']
-
-    relations: List[int] = []
-
-    for i in range(0, len(data)):
-        if(data[i]['relation'] == 'Adaptation'):
-            adapts = data[i]['entry']
-            for entry in adapts:
-                if(entry['type'] == 'anime'):
-                    relations.append(entry['mal_id'])
-            return {'source_id': source_id, 'relations': relations}
-
-    
-
-def getSource(id):
-    '''
-    Returns the source material id 
-    '''
-    url = 'https://api.jikan.moe/v4/anime/{id}/relations'.format(id=id)
-    time.sleep(0.5)
-    data = requests.get(url).json()['data']
-    
-    for i in range(0, len(data)):
-        if(data[i]['relation'] == 'Adaptation'):
-            ## can be multiple source materials - i.e. Classroom of the Elite has the LN (89357) and the newer manga (96371)
-                # Look for the lowest id which ensures that it is the true source material (oldest)
-            source = data[i]['entry']
-            min = source[0]['mal_id']
-            for entry in source:
-                if(entry['mal_id'] < min):
-                    min = entry['mal_id']
-            return min
-        
-    # no adaptation --> anime original
-    return -1 
-    
-
-        
-            
-def getRelation(id, recursedArr: list):
-    blacklist = ['Other', 'Summary', 'Character']
-    time.sleep(.5)
-    recursedArr.append(id)
-
-    try:
-        response = requests.get("https://api.jikan.moe/v4/anime/{id}/relations".format(id = id))
-        if response.status_code == 404:
-            print('ignored 404')
-            return 0
-        response = response.json()
-    except:
-        print('uhhhh')
-        return 0
-    else:
-        count = 0
-        for relations in response['data']:
-            if(relations['relation'] in blacklist): # blacklisting doodoo relations as they are often irrelevant
-                continue
-            for entries in relations['entry']:
-                if(entries['mal_id'] not in recursedArr and entries['type'] == 'anime'):
-                    return getRelation(entries['mal_id'], recursedArr)
-
-    
-
-
-
-                    
-
-
-
-
-
-
-
-
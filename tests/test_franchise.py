@@ -0,0 +1,48 @@
+import pytest
+from sqlalchemy import text
+import src.db
+from src.franchise import FranchiseGraph
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    '''
+    The process-wide engine pointed at a temporary sqlite relations table.
+    '''
+    monkeypatch.setenv('SQL_ALCHEMY_CRED', f'sqlite:///{tmp_path / "db.sqlite"}')
+    monkeypatch.setattr(src.db, 'engine', None)
+    engine = src.db.get_engine()
+    with engine.begin() as conn:
+        conn.execute(text('CREATE TABLE relations (source_id INTEGER PRIMARY KEY, relations TEXT)'))
+        conn.execute(text("INSERT INTO relations VALUES (200, '10, 11'), (-1, '1, 2, 3')"))
+    yield engine
+    engine.dispose()
+
+
+def stored(engine):
+    with engine.connect() as conn:
+        return dict(conn.execute(text('SELECT source_id, relations FROM relations')).fetchall())
+
+
+def test_load_builds_the_graph(engine):
+    franchise = FranchiseGraph.load(engine, catalog_ids=[11, 2])
+
+    assert franchise.source_of(10) == 200
+    assert franchise.representative(10) == 11
+    assert franchise.representative(1) == 2
+    assert franchise.source_of(99) is None
+    assert franchise.representative(99) is None
+    assert franchise.in_catalog(2) and not franchise.in_catalog(1)
+
+
+def test_writer_saves_new_and_extended_franchises(engine):
+    franchise = FranchiseGraph.load(engine, catalog_ids=[11, 2, 21])
+
+    assert franchise.add(300, [20, 21]) == [20, 21]
+    assert franchise.add(200, [10, 12]) == [12]
+    assert franchise.add(-1, [3, 1]) == [] # nothing new, nothing written
+    franchise.writer.queue.join()
+
+    assert franchise.representative(20) == 21
+    assert stored(engine) == {200: '10, 11, 12', -1: '1, 2, 3', 300: '20, 21'}
+    assert FranchiseGraph.load(engine, catalog_ids=[21]).representative(20) == 21
@@ -0,0 +1,29 @@
+import json
+import numpy as np
+import pandas as pd
+from src.genres import GenreIndex
+from src.records import RecordStore, anime_records
+
+
+def test_genre_records_share_the_catalog_fragments():
+    anime_df = pd.DataFrame({
+        'anime_id': np.array([1, 2, 3], dtype=np.int32),
+        'name': ['Naruto', 'Steins;Gate', 'Monster'],
+        'english_name': ['Naruto', None, 'Monster'],
+        'other_name': ['ナルト', 'シュタインズ・ゲート', 'モンスター'],
+        'score': np.array([8.0, 9.1, np.nan], dtype=np.float16),
+        'image': ['a.jpg', 'b.jpg', 'c.jpg'],
+        'synopsis': ['ninja', 'time "travel"', 'doctor'],
+        'genres': ['Action Shounen', 'Sci_Fi Thriller', 'Thriller'],
+    })
+    records = RecordStore.from_records(anime_records(anime_df))
+    index = GenreIndex(anime_df, records)
+
+    # same response as encoding the catalog without anime_id, missing values as null
+    expected = json.loads(anime_df.drop('anime_id', axis=1).to_json(orient='records'))
+    rows = index.query(['Thriller'], min_score=0)
+    assert rows.tolist() == [1]
+    assert json.loads(index.records.take([0, 1, 2]).encode()) == expected
+
+    synopsis = index.records.fields.index('synopsis')
+    assert all(genre[synopsis] is record[records.fields.index('synopsis')] for genre, record in zip(index.records.records, records.records))
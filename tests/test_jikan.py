@@ -0,0 +1,93 @@
+import httpx
+import pytest
+from src.jikan import JikanResolver, RelationStore
+
+
+def adaptation(*entries):
+    return {'relation': 'Adaptation', 'entry': [{'mal_id': id, 'type': type} for id, type in entries]}
+
+def related(relation: str, *ids):
+    return {'relation': relation, 'entry': [{'mal_id': id, 'type': 'anime'} for id in ids]}
+
+
+RESPONSES = {
+    # 10 is adapted from two manga, the oldest (200) is the source
+    '/anime/10/relations': [adaptation((300, 'manga'), (200, 'manga'))],
+    '/manga/200/relations': [related('Side story', 99), adaptation((10, 'anime'), (11, 'anime'), (300, 'manga'))],
+    # anime originals: 1 -> 2 -> 3 -> ... through sequels, summaries and prequels already in the chain are skipped
+    **{f'/anime/{id}/relations': [related('Summary', 500 + id), related('Prequel', id - 1), related('Sequel', id + 1)] for id in range(2, 10)},
+    '/anime/1/relations': [related('Summary', 501), related('Sequel', 2)],
+}
+
+
+class StubJikan():
+    """
+      Stands in for the Jikan API: answers RESPONSES, 500 for /anime/500/relations and 404 for anything else.
+    """
+    def __init__(self):
+        self.paths = []
+
+    def __call__(self, request: httpx.Request):
+        path = request.url.path.removeprefix('/v4')
+        self.paths.append(path)
+        if(path == '/anime/500/relations'):
+            return httpx.Response(500)
+        if(path in RESPONSES):
+            return httpx.Response(200, json={'data': RESPONSES[path]})
+        return httpx.Response(404, json={'status': 404})
+
+
+@pytest.fixture
+def stub():
+    return StubJikan()
+
+@pytest.fixture
+def resolver(stub, tmp_path):
+    '''
+    A resolver against the stub, memoising into a temporary sqlite file, without rate limit or retries.
+    '''
+    resolver = JikanResolver(base_url='http://jikan.test/v4', store=RelationStore(str(tmp_path / 'jikan.sqlite3')),
+                             rate=1000, burst=1000, depth=4, retries=0, transport=httpx.MockTransport(stub))
+    yield resolver
+    resolver.close()
+
+
+def test_manga_source(resolver):
+    assert resolver.run(resolver.relations(10)) == {'source_id': 200, 'relations': [10, 11]}
+
+
+def test_anime_original_chain_is_capped(resolver, stub):
+    assert resolver.run(resolver.relations(1)) == {'source_id': -1, 'relations': [1, 2, 3, 4]}
+    # the chain starts from the response source() fetched, every anime is fetched once
+    assert stub.paths == ['/anime/1/relations', '/anime/2/relations', '/anime/3/relations']
+
+
+def test_not_found_is_memoised_as_empty(resolver, stub):
+    assert resolver.run(resolver.relations(404)) == {'source_id': -404, 'relations': [404]}
+    assert resolver.store.get('/anime/404/relations') == []
+
+    resolver.run(resolver.relations(404))
+    assert stub.paths == ['/anime/404/relations']
+
+
+def test_failures_are_none_in_relations_many(resolver, stub):
+    found = resolver.run(resolver.relations_many([10, 500]))
+
+    assert found == [{'source_id': 200, 'relations': [10, 11]}, None]
+    assert resolver.store.get('/anime/500/relations') is None # errors are not memoised
+
+
+def test_second_resolver_is_served_from_the_sqlite_memo(resolver, stub, tmp_path):
+    resolver.run(resolver.relations_many([10, 1]))
+    fetched = len(stub.paths)
+
+    again = StubJikan()
+    second = JikanResolver(base_url='http://jikan.test/v4', store=RelationStore(str(tmp_path / 'jikan.sqlite3')),
+                           depth=4, retries=0, transport=httpx.MockTransport(again))
+    try:
+        assert second.run(second.relations_many([10, 1])) == [{'source_id': 200, 'relations': [10, 11]},
+                                                              {'source_id': -1, 'relations': [1, 2, 3, 4]}]
+    finally:
+        second.close()
+    assert fetched == 5
+    assert again.paths == []
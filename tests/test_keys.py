@@ -0,0 +1,59 @@
+import pandas as pd
+import pytest
+from fastapi.testclient import TestClient
+import main
+from src.coalesce import SingleFlight
+from src.search import Search
+
+
+class TitleExecutor():
+    """
+      Thread-pool stand-in: holds a Search like the shared Recommend and answers every call with its arguments.
+    """
+    def __init__(self, search: Search):
+        self.instance = self
+        self.search = search
+        self.calls = []
+
+    async def run(self, stage: str, method: str, *args):
+        self.calls.append((method, args))
+        if(method == 'get_rec_batch'):
+            return {'records': [repr(args)], 'unresolved': []}
+        return [repr(args)]
+
+
+@pytest.fixture
+def api():
+    anime_df = pd.DataFrame({
+        'anime_id': [1, 2, 3, 4],
+        'name': ['Working!!', "Working'!!", 'Re:Zero', 'Re Zero'],
+        'english_name': ['Wagnaria!!', 'Wagnaria 2', 'Re:ZERO', 'Re ZERO 2'],
+        'other_name': [None, None, None, None],
+        'score': [8.0, 7.0, 9.0, 6.0],
+    })
+    main.app.state.flights = SingleFlight()
+    main.app.state.executor = TitleExecutor(Search(anime_df))
+    return TestClient(main.app)
+
+
+def test_titles_that_normalise_alike_do_not_share_a_result(api):
+    assert api.get('/categories/anime/Working!!').json()['data'] == ["('Working!!',)"]
+    assert api.get("/categories/anime/Working'!!").json()['data'] == ["(\"Working'!!\",)"]
+    assert api.get('/categories/anime/Re Zero').json()['data'] == ["('Re Zero',)"]
+    assert len(main.app.state.executor.calls) == 3
+
+
+def test_titles_of_one_anime_share_a_result(api):
+    api.get('/categories/anime/Re:Zero')
+    api.get('/categories/anime/Re:ZERO')
+    assert len(main.app.state.executor.calls) == 1
+
+
+def test_batches_of_titles_that_normalise_alike_do_not_share_a_result(api):
+    first = api.post('/categories/batch', json={'seeds': [{'anime': 'Working!!'}, {'anime': 'Re:Zero', 'weight': 2}]})
+    second = api.post('/categories/batch', json={'seeds': [{'anime': "Working'!!"}, {'anime': 'Re Zero', 'weight': 2}]})
+    same = api.post('/categories/batch', json={'seeds': [{'anime': 'Wagnaria!!'}, {'anime': 'Re:ZERO', 'weight': 2}]})
+
+    assert first.json()['data'] != second.json()['data']
+    assert same.json()['data'] == first.json()['data']
+    assert len(main.app.state.executor.calls) == 2
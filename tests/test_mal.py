@@ -0,0 +1,158 @@
+import asyncio
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+import main
+from src.cache import UserListCache
+from src.coalesce import SingleFlight
+from src.mal import MALClient, MALError, completed
+
+BASE_URL = 'http://mal.test/v2'
+
+
+def entry(id: int, status: str, score: int):
+    return {'node': {'id': id, 'title': f't{id}', 'genres': [{'id': 1, 'name': 'Action'}]},
+            'list_status': {'status': status, 'score': score}}
+
+
+class StubMAL():
+    """
+      Stands in for the MAL API: /users/{user}/animelist answers from `responses` (user -> list of responses,
+      the last one repeating), paged lists follow paging.next. Every request is recorded.
+    """
+    def __init__(self, responses: dict = None):
+        self.responses = responses or {}
+        self.requests = []
+
+    def __call__(self, request: httpx.Request):
+        self.requests.append(request)
+        user = request.url.path.split('/')[3]
+        if(user == 'paged'):
+            offset = int(request.url.params.get('offset', 0))
+            body = {'data': [entry(id, 'completed' if id % 2 else 'watching', 10 - id) for id in range(offset, offset + 2)], 'paging': {}}
+            if(offset < 4):
+                body['paging']['next'] = f'{BASE_URL}/users/paged/animelist?offset={offset + 2}'
+            return httpx.Response(200, json=body)
+
+        responses = self.responses[user]
+        calls = sum(1 for r in self.requests if r.url.path.split('/')[3] == user)
+        return responses[min(calls, len(responses)) - 1]
+
+    def client(self, **kwargs):
+        return MALClient(client_id='test', base_url=BASE_URL, transport=httpx.MockTransport(self), backoff=0, **kwargs)
+
+
+def fetch(stub: StubMAL, user: str, **kwargs):
+    async def run():
+        client = stub.client(**kwargs)
+        try:
+            return await client.get_animelist(user)
+        finally:
+            await client.aclose()
+    return asyncio.run(run())
+
+
+def test_follows_paging_next():
+    stub = StubMAL()
+    animes, validators = fetch(stub, 'paged')
+
+    assert [anime['node']['id'] for anime in animes] == [0, 1, 2, 3, 4, 5]
+    assert len(stub.requests) == 3
+    assert validators == {} # a multi-page list cannot be revalidated from its first page
+
+
+@pytest.mark.parametrize('status', [429, 500, 503])
+def test_retries_rate_limits_and_server_errors(status):
+    stub = StubMAL({'alice': [httpx.Response(status), httpx.Response(200, json={'data': [entry(1, 'completed', 8)], 'paging': {}})]})
+    animes, _ = fetch(stub, 'alice')
+
+    assert [anime['node']['id'] for anime in animes] == [1]
+    assert len(stub.requests) == 2
+
+
+def test_gives_up_after_retries():
+    stub = StubMAL({'alice': [httpx.Response(503)]})
+    with pytest.raises(MALError) as e:
+        fetch(stub, 'alice', retries=2)
+
+    assert e.value.status_code == 503
+    assert len(stub.requests) == 3
+
+
+def test_long_retry_after_fails_instead_of_sleeping():
+    stub = StubMAL({'alice': [httpx.Response(429, headers={'Retry-After': '3600'})]})
+    with pytest.raises(MALError) as e:
+        fetch(stub, 'alice', max_retry_after=5)
+
+    assert e.value.status_code == 429
+    assert len(stub.requests) == 1
+
+
+def test_does_not_retry_client_errors():
+    stub = StubMAL({'missing': [httpx.Response(404)]})
+    with pytest.raises(MALError) as e:
+        fetch(stub, 'missing')
+
+    assert e.value.status_code == 404
+    assert len(stub.requests) == 1
+
+
+def test_completed_is_a_subset_of_the_list():
+    animes = [entry(1, 'completed', 9), entry(2, 'watching', 8), entry(3, 'completed', 0), entry(4, 'dropped', 2)]
+    assert completed(animes) == [animes[0], animes[2]]
+
+
+class FakeExecutor():
+    """
+      Records the Recommend calls main.py makes instead of running them.
+    """
+    def __init__(self):
+        self.instance = None # as a process pool, no catalog in this process
+        self.calls = []
+
+    async def run(self, stage: str, method: str, *args):
+        self.calls.append((method, args))
+        return []
+
+    def stats(self):
+        return {}
+
+
+@pytest.fixture
+def api():
+    '''
+    The app with a stub MAL behind it, without the lifespan (no catalog is loaded).
+    '''
+    stub = StubMAL({
+        'alice': [httpx.Response(200, json={'data': [entry(1, 'completed', 9), entry(2, 'watching', 7), entry(3, 'completed', 5)], 'paging': {}})],
+        'missing': [httpx.Response(404)],
+        'broken': [httpx.Response(403)],
+        'down': [httpx.Response(503)],
+    })
+    main.app.state.user_lists = UserListCache(stub.client(retries=1), directory=None)
+    main.app.state.flights = SingleFlight()
+    main.app.state.executor = FakeExecutor()
+    return TestClient(main.app), stub
+
+
+def test_user_endpoint_fetches_the_list_once(api):
+    client, stub = api
+    r = client.get('/categories/user/alice')
+
+    assert r.status_code == 200
+    assert len(stub.requests) == 1
+    method, (userlist, allAnimes) = main.app.state.executor.calls[0]
+    assert method == 'get_rec_user'
+    assert [anime['node']['id'] for anime in allAnimes] == [1, 2, 3]
+    assert [anime['node']['id'] for anime in userlist] == [1, 3]
+
+
+def test_user_endpoint_maps_mal_404_to_404(api):
+    client, _ = api
+    assert client.get('/categories/user/missing').status_code == 404
+
+
+@pytest.mark.parametrize('user', ['broken', 'down'])
+def test_user_endpoint_maps_other_mal_errors_to_502(api, user):
+    client, _ = api
+    assert client.get(f'/categories/user/{user}').status_code == 502
@@ -0,0 +1,30 @@
+import json
+import pytest
+from fastapi import HTTPException
+from main import page_response
+from src.records import RecordStore
+
+
+@pytest.fixture
+def ranking():
+    return RecordStore.from_records({'id': id, 'name': f'a{id}'} for id in range(5)).take([4, 2, 0])
+
+
+def test_pages_follow_the_cursor(ranking):
+    first = json.loads(page_response(ranking, {'limit': 2}).body)
+    second = json.loads(page_response(ranking, {'limit': 2, 'cursor': first['next']}).body)
+
+    assert [record['id'] for record in first['data']] == [4, 2]
+    assert second == {'data': [{'id': 0, 'name': 'a0'}], 'next': None}
+
+
+@pytest.mark.parametrize('page', [{'cursor': '!!'}, {'fields': ['id', 'rank']}])
+def test_bad_page_requests_are_400(ranking, page):
+    with pytest.raises(HTTPException) as e:
+        page_response(ranking, page)
+    assert e.value.status_code == 400
+
+
+def test_encoding_errors_are_not_400():
+    with pytest.raises(ValueError): # NaN is not JSON, a server error rather than a bad request
+        page_response([float('nan')], {})
@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+from src.build_similarity import save
+from src.similarity import NeighborIndex, SimilarityStore, build_neighbors, load_neighbors
+
+
+def test_neighbors_skip_missing_similarities():
+    matrix = np.array([
+        [1.0, 0.2, np.nan, 0.9],
+        [0.2, 1.0, np.nan, np.nan],
+        [np.nan, np.nan, 1.0, np.nan], # rated by nobody else
+        [0.9, np.nan, np.nan, 1.0],
+    ], dtype=np.float16)
+    index = build_neighbors(SimilarityStore(matrix, np.array([10, 20, 30, 40], dtype=np.int32)), k=3, block=2)
+
+    assert index.positions.tolist() == [[3, 1, -1], [0, -1, -1], [-1, -1, -1], [0, -1, -1]]
+    assert np.isfinite(index.similarities).all()
+
+    ids, similarities = index.neighbors(10)
+    assert ids.tolist() == [40, 20]
+    assert similarities.tolist() == [np.float32(np.float16(0.9)), np.float32(np.float16(0.2))]
+    assert index.neighbors(30)[0].tolist() == []
+
+
+def test_offline_table_is_not_rebuilt_from_an_older_dense_store(tmp_path):
+    ids = [10, 20, 30, 40]
+    matrix = np.array([[1, .5, .2, .9], [.5, 1, .3, .1], [.2, .3, 1, .4], [.9, .1, .4, 1]], dtype=np.float32)
+    pd.DataFrame(matrix, index=ids, columns=[str(id) for id in ids]).to_csv(tmp_path / 'Data.csv')
+    directory = str(tmp_path / 'model')
+
+    assert load_neighbors(k=3, directory=directory, csv_path=str(tmp_path / 'Data.csv')).k == 3
+
+    offline = NeighborIndex(np.array(ids, dtype=np.int32), np.array([[1], [2], [3], [0]], dtype=np.int32),
+                            np.full((4, 1), .5, dtype=np.float16))
+    save(offline, directory) # smaller k than the service asks for
+
+    loaded = load_neighbors(k=3, directory=directory, csv_path=str(tmp_path / 'Data.csv'))
+    assert loaded.k == 1
+    assert np.asarray(loaded.positions).tolist() == [[1], [2], [3], [0]]
+    assert not SimilarityStore.exists(directory)
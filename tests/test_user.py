@@ -0,0 +1,65 @@
+import asyncio
+import numpy as np
+import pandas as pd
+import pytest
+import src.user
+from src.franchise import FranchiseGraph
+from src.similarity import NeighborIndex
+from src.user import resolveAnimes
+
+CATALOG = range(1, 21)
+
+
+class StubResolver():
+    """
+      Stands in for the JikanResolver: answers relations_many from `found` and records every batch.
+    """
+    def __init__(self, found: dict):
+        self.found = found
+        self.batches = []
+
+    def run(self, coro):
+        return asyncio.run(coro)
+
+    async def relations_many(self, ids: list):
+        self.batches.append(list(ids))
+        return [self.found.get(id) for id in ids]
+
+
+@pytest.fixture
+def franchise():
+    # 50 is only known through the relations table, its franchise's catalog anime is 2
+    return FranchiseGraph(pd.DataFrame({'source_id': [100], 'relations': ['50, 2']}), CATALOG)
+
+@pytest.fixture
+def neighbors():
+    ids = np.array([id for id in CATALOG if id != 5], dtype=np.int32) # 5 has no ratings
+    return NeighborIndex(ids, np.full((len(ids), 1), -1, dtype=np.int32), np.zeros((len(ids), 1), dtype=np.float16))
+
+def use_resolver(monkeypatch, found: dict):
+    resolver = StubResolver(found)
+    monkeypatch.setattr(src.user, 'get_resolver', lambda: resolver)
+    return resolver
+
+
+def test_candidates_resolve_in_order(monkeypatch, franchise, neighbors):
+    resolver = use_resolver(monkeypatch, {60: {'source_id': 300, 'relations': [60, 9]}}) # 61 fails
+    candidates = [3, 50, 3, 5, 2, 60, 61, 7, 8, 11, 12, 13, 14, 15, 16, 17]
+
+    topAnimes, positions = resolveAnimes(candidates, franchise, neighbors)
+
+    # duplicates (3, and 2 through 50) kept once, 5 skipped, 60 resolved through Jikan, 61 skipped
+    assert topAnimes == [3, 2, 9, 7, 8, 11, 12, 13, 14, 15]
+    assert positions == [0, 1, 5, 7, 8, 9, 10, 11, 12, 13]
+    assert resolver.batches == [[60, 61]]
+    assert franchise.representative(60) == 9
+
+
+def test_jikan_lookups_are_bounded_by_the_free_slots(monkeypatch, franchise):
+    resolver = use_resolver(monkeypatch, {60: {'source_id': 300, 'relations': [60, 9]}, 62: {'source_id': 301, 'relations': [62, 10]}})
+
+    topAnimes, positions = resolveAnimes([3, 60, 61, 62, 63, 64], franchise, limit=3)
+
+    assert topAnimes == [3, 9, 10]
+    assert positions == [0, 1, 3]
+    assert resolver.batches == [[60, 61], [62]] # 63 and 64 could not make it, never looked up